@@ -47,6 +47,18 @@ RESOURCES = {
         'tor': {
             "collection_actions":['create'],
             "member_actions":['delete']
+        },
+        'reconcile': {
+            "collection_actions":['create'],
+            "member_actions":[]
+        },
+        'metrics': {
+            "collection_actions":['index'],
+            "member_actions":[]
+        },
+        'health': {
+            "collection_actions":['index'],
+            "member_actions":[]
         }
 }
 COLLECTION_ACTIONS = 'collection_actions'
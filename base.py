@@ -1,5 +1,6 @@
 #/usr/bin/env python
 # encoding: utf-8
+import contextlib
 
 class ConfigFailError(Exception):
     pass
@@ -28,3 +29,52 @@ class SwitchDriverBase(object):
 
     def ensureVxlanWithTunnel(self, vxlan, tunnel_id):
         pass
+
+    def reconcile(self, desired):
+        """Bring the switch to the desired state, return what was changed
+        or None when the switch can not be reconciled."""
+        return None
+
+    def lldp(self):
+        """Return the LLDP (local, remote) data of the switch, shaped as
+        TopofRacks parses it out of the LLDP MIB, or None when the driver
+        can not read it."""
+        return None
+
+    def batch(self, calls):
+        """Apply (method, args) driver calls, return the ones that failed."""
+        failed = []
+        for method, args in calls:
+            if not getattr(self, method)(*args):
+                failed.append((method, args))
+        return failed
+
+    def begin(self):
+        pass
+
+    def forget(self, mgr):
+        """Drop what is kept for the switch mgr, which was deleted."""
+        pass
+
+    def in_transaction(self):
+        """Whether the edits made now wait for commit, or are on the
+        switch already."""
+        return False
+
+    def commit(self):
+        return True
+
+    def rollback(self):
+        pass
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Apply the edits made inside the block at once, or not at all."""
+        self.begin()
+        try:
+            yield self
+        except Exception:
+            self.rollback()
+            raise
+        if not self.commit():
+            raise ConfigFailError("commit failed")
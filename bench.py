@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Microbenchmarks of the sapi control plane.
+
+Drives create_sync, create_tor, create_localvlan and delete_localvlan of
+Sapi on a synthetic fabric of N tors with M hosts each and K networks,
+with the switches replaced by torconf.fake.FakeSwitchDriver, the
+topology made up instead of walked and the database on SQLite:
+
+    python -m torconf.bench --tors 10 --hosts 20 --networks 10
+
+For every operation it prints ops/sec, p50/p99 latency and the database
+queries and driver calls per op.
+
+With --overlap it instead sends the same edits to N switches of a
+torconf.simulator fabric through the H3C driver, once with the blocking
+I/O on the eventlet hub (tpool_size 0) and once offloaded to native
+threads, and prints how far the requests to different switches overlap:
+
+    python -m torconf.bench --overlap --tors 20 --latency 0.1
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import eventlet
+from oslo.config import cfg
+from oslo.db import options as db_options
+from sqlalchemy import event
+
+from torconf import db
+from torconf import fake  # registers the [fake] options
+from torconf import h3c
+from torconf import model_base
+from torconf import sapi
+from torconf import server
+from torconf import simulator
+from torconf import topology
+
+CONF = cfg.CONF
+SWITCH_TYPE = "h3c"
+
+
+class Fabric(object):
+    """N tors with M hosts each and K networks, one port per host and
+    network picked round robin."""
+
+    def __init__(self, tors, hosts, networks, ports_per_host):
+        self.tors = ["10.%d.%d.1" % (i / 256, i % 256) for i in range(tors)]
+        self.tunnel_src = dict((tor, "172.%d.%d.1" % (16 + i / 256, i % 256))
+                               for i, tor in enumerate(self.tors))
+        self.hosts = dict((tor, ["host-%d-%d" % (i, h) for h in range(hosts)])
+                          for i, tor in enumerate(self.tors))
+        self.networks = ["net-%d" % n for n in range(networks)]
+        self.ports = []
+        n = 0
+        for tor in self.tors:
+            for host in self.hosts[tor]:
+                for p in range(ports_per_host):
+                    net = self.networks[n % len(self.networks)]
+                    self.ports.append(("port-%d" % n, net, host))
+                    n += 1
+
+    def sync_body(self):
+        networks = [{"id": net,
+                     "tenant_id": "bench",
+                     "provider:network_type": "vxlan",
+                     "provider:segmentation_id": 1000 + i,
+                     "admin_state_up": True,
+                     "shared": False} for i, net in enumerate(self.networks)]
+        ports = [{"id": port_id,
+                  "tenant_id": "bench",
+                  "network_id": net,
+                  "device_id": host,
+                  "device_owner": "compute:bench",
+                  "status": "ACTIVE",
+                  "admin_state_up": True,
+                  "binding:host_id": host,
+                  "mac_address": "fa:16:3e:00:%02x:%02x" % (i / 256 % 256, i % 256),
+                  "fixed_ips": [{"ip_address": "192.168.%d.%d" % (i / 256 % 256, i % 256),
+                                 "subnet_id": "subnet-" + net}]}
+                 for i, (port_id, net, host) in enumerate(self.ports)]
+        subnets = [{"id": "subnet-" + net,
+                    "tenant_id": "bench",
+                    "network_id": net,
+                    "shared": False,
+                    "enable_dhcp": True} for net in self.networks]
+        return {"sina_openstack": {"network": networks,
+                                   "port": ports,
+                                   "subnet": subnets}}
+
+
+class FabricTopofRacks(topology.TopofRacks):
+    """TopofRacks with the LLDP neighbours taken from a Fabric."""
+
+    def __init__(self, fabric):
+        self.fabric = fabric
+        super(FabricTopofRacks, self).__init__(fabric.tors)
+
+    def _get_topology(self):
+        updates = []
+        for tor in self.topofracks:
+            topology, topology_sp = {}, []
+            for index, host in enumerate(self.fabric.hosts[tor], 1):
+                topology[index] = {"index_name": "Ten-GigabitEthernet1/0/%d" % index,
+                                   "tor_ip": tor,
+                                   "tor": "tor-" + tor,
+                                   "host": host,
+                                   "desc": host,
+                                   "host_ip": "",
+                                   "mac": "",
+                                   "interface": "eth0"}
+                topology_sp.append(host)
+            self._read_at[tor] = time.time()
+            updates.append((tor, topology, topology_sp))
+        self._set_tors(updates)
+
+
+class FabricRpc(object):
+    """Answers tunnel_sync with the tunnel endpoints seen so far."""
+
+    def __init__(self):
+        self.endpoints = []
+
+    def tunnel_sync(self, ip, type):
+        if ip not in self.endpoints:
+            self.endpoints.append(ip)
+        return {"tunnels": [{"ip_address": ip} for ip in self.endpoints]}
+
+
+class BenchSapi(sapi.Sapi):
+    def __init__(self, fabric):
+        self.fabric = fabric
+        sapi.Sapi.__init__(self)
+
+    def _setup_rpc(self):
+        self.rpc = FabricRpc()
+
+    def _setup_topology(self):
+        self.tors = FabricTopofRacks(self.fabric)
+
+    @property
+    def driver(self):
+        driver = self.switch_drivers[SWITCH_TYPE]
+        return getattr(driver, 'driver', driver)
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def _percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def run(name, app, queries, func, items, concurrency):
+    """Run func on every item, print and return the statistics."""
+    latencies = []
+    errors = [0]
+    def _timed(item):
+        start = time.time()
+        try:
+            func(item)
+        except Exception as e:
+            errors[0] += 1
+            print "%s %s failed: %s" % (name, item, e)
+        latencies.append(time.time() - start)
+
+    calls, count = len(app.driver.calls), queries.count
+    start = time.time()
+    pool = eventlet.GreenPool(max(concurrency, 1))
+    for item in items:
+        pool.spawn_n(_timed, item)
+    pool.waitall()
+    elapsed = time.time() - start
+
+    ops = max(len(items), 1)
+    stats = {"ops": len(items),
+             "errors": errors[0],
+             "ops_per_sec": len(items) / elapsed if elapsed else 0,
+             "p50_ms": _percentile(latencies, 50) * 1000,
+             "p99_ms": _percentile(latencies, 99) * 1000,
+             "queries_per_op": float(queries.count - count) / ops,
+             "driver_calls_per_op": float(len(app.driver.calls) - calls) / ops}
+    print ("%-17s %6d ops %4d errors %9.1f ops/s p50 %8.2fms p99 %8.2fms "
+           "%6.1f queries/op %6.1f driver calls/op" % (
+               name, stats["ops"], stats["errors"], stats["ops_per_sec"],
+               stats["p50_ms"], stats["p99_ms"], stats["queries_per_op"],
+               stats["driver_calls_per_op"]))
+    return stats
+
+
+def _start_simulator(args):
+    proc = subprocess.Popen([sys.executable, '-m', 'torconf.simulator',
+                             '--switches', str(args.tors),
+                             '--base-ip', args.base_ip,
+                             '--port', str(args.port),
+                             '--latency', str(args.latency)])
+    last = simulator.ip_str(simulator.struct_ip(args.base_ip) + args.tors - 1)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection((last, args.port), 1).close()
+            return proc
+        except socket.error:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("simulator did not come up")
+
+
+def overlap(args):
+    """Edit every simulated switch concurrently, with the blocking calls
+    on the hub and on the thread pool."""
+    #the API server runs with green sockets, see wsgi.py.
+    eventlet.monkey_patch(all=False, thread=None, socket=True)
+    CONF([], project='sapi', default_config_files=args.config_file)
+    CONF.set_override('port', args.port, group='netconf')
+    CONF.set_override('keepalive_interval', 0, group='netconf')
+    proc = _start_simulator(args)
+    try:
+        first = simulator.struct_ip(args.base_ip)
+        tors = [simulator.ip_str(first + i) for i in range(args.tors)]
+        driver = h3c.H3CNetConfDriver()
+        for tor in tors:
+            if not driver.initialize(tor, "sinanp", "sinanp"):
+                raise RuntimeError("tor %s unreachable" % tor)
+
+        def _edit(tor, round):
+            driver.initialize(tor, "sinanp", "sinanp")
+            latencies = []
+            for i in range(args.requests):
+                start = time.time()
+                driver.newvlan2vxlan(i + 1, 100 + round, 5000 + i)
+                latencies.append(time.time() - start)
+            return latencies
+
+        #the pool size is fixed once the first offloaded call sets it up,
+        #so the hub-only round goes first.
+        for round, size in enumerate((0, args.tpool_size)):
+            CONF.set_override('tpool_size', size)
+            pool = eventlet.GreenPool(len(tors))
+            start = time.time()
+            latencies = sum(pool.imap(_edit, tors, [round] * len(tors)), [])
+            elapsed = time.time() - start
+            busy = sum(latencies)
+            print ("tpool_size %3d %4d switches %6d edits %8.2fs wall %8.2fs busy "
+                   "overlap %5.1fx p50 %8.2fms p99 %8.2fms" % (
+                       size, len(tors), len(latencies), elapsed, busy,
+                       busy / elapsed if elapsed else 0,
+                       _percentile(latencies, 50) * 1000,
+                       _percentile(latencies, 99) * 1000))
+    finally:
+        proc.kill()
+
+
+def control_plane(args):
+    server.register_opts(CONF)
+    CONF([], project='sapi', default_config_files=args.config_file)
+    path = None
+    connection = args.connection
+    if connection is None:
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        connection = "sqlite:///" + path
+    db_options.set_defaults(CONF, connection=connection)
+    CONF.set_override('call_delay', args.call_delay, group='fake')
+    CONF.set_override(SWITCH_TYPE, 'torconf.fake.FakeSwitchDriver', group='switchs')
+    CONF.set_override('reconcile_interval', 0)
+
+    try:
+        engine = db.get_engine()
+        model_base.BASE.metadata.create_all(engine)
+        queries = QueryCounter(engine)
+
+        fabric = Fabric(args.tors, args.hosts, args.networks, args.ports_per_host)
+        app = BenchSapi(fabric)
+        print "%d tors, %d hosts, %d networks, %d ports" % (
+            len(fabric.tors), sum(len(h) for h in fabric.hosts.values()),
+            len(fabric.networks), len(fabric.ports))
+
+        body = fabric.sync_body()
+        run("create_sync", app, queries,
+            lambda _: app.create_sync(None, body=body), [None], 1)
+        #every tor joins the ones before it, so tors are added in order.
+        run("create_tor", app, queries,
+            lambda tor: app.create_tor(None, body={"switch_type": SWITCH_TYPE,
+                                                   "tunnel_src": fabric.tunnel_src[tor],
+                                                   "mgr": tor}),
+            fabric.tors, 1)
+        run("create_localvlan", app, queries,
+            lambda port: app.create_localvlan(None, body={"netid": port[1],
+                                                          "host": port[2],
+                                                          "portid": port[0]}),
+            fabric.ports, args.concurrency)
+        run("delete_localvlan", app, queries,
+            lambda port: app.delete_localvlan(None, port[0]),
+            fabric.ports, args.concurrency)
+    finally:
+        if path:
+            os.unlink(path)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sapi control plane benchmark")
+    parser.add_argument('--tors', type=int, default=10)
+    parser.add_argument('--hosts', type=int, default=20,
+                        help="hosts per tor")
+    parser.add_argument('--networks', type=int, default=10)
+    parser.add_argument('--ports-per-host', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="operations running at the same time")
+    parser.add_argument('--call-delay', type=float, default=0.0,
+                        help="seconds every driver call takes")
+    parser.add_argument('--connection', default=None,
+                        help="database url, a fresh SQLite file by default")
+    parser.add_argument('--config-file', action='append', default=[])
+    parser.add_argument('--overlap', action='store_true',
+                        help="measure concurrent edits of simulated switches")
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help="seconds every RPC of a simulated switch takes")
+    parser.add_argument('--requests', type=int, default=5,
+                        help="edits sent to every simulated switch")
+    parser.add_argument('--base-ip', default='127.0.1.1')
+    parser.add_argument('--port', type=int, default=8300)
+    parser.add_argument('--tpool-size', type=int, default=20)
+    args = parser.parse_args()
+    if args.overlap:
+        overlap(args)
+    else:
+        control_plane(args)
+
+
+if __name__ == "__main__":
+    main()
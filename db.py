@@ -1,16 +1,21 @@
 #!/usr/bin/env python
 # encoding: utf-8
+import threading
+
 from oslo.config import cfg
 from oslo.db.sqlalchemy import session
 
 _FACADE = None
+#model calls may run on several native threads, see utils.offload.
+_FACADE_LOCK = threading.Lock()
 
 
 def _create_facade_lazily():
     global _FACADE
 
-    if _FACADE is None:
-        _FACADE = session.EngineFacade.from_config(cfg.CONF, sqlite_fk=True)
+    with _FACADE_LOCK:
+        if _FACADE is None:
+            _FACADE = session.EngineFacade.from_config(cfg.CONF, sqlite_fk=True)
 
     return _FACADE
 
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import random
+import collections
+
+import eventlet
+from eventlet import corolocal
+from oslo.config import cfg
+
+from torconf.base import SwitchDriverBase
+
+fake_opts = [
+    cfg.FloatOpt('call_delay', default=0,
+                 help="Seconds every call of the fake switch driver takes"),
+    cfg.FloatOpt('call_jitter', default=0,
+                 help="Random seconds added to or taken from call_delay"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(fake_opts, group='fake')
+
+
+class _FakeSwitch(object):
+    """Configuration of one fake switch."""
+
+    def __init__(self):
+        self.tunnels = {}
+        self.ports = {}
+        self.vxlans = set()
+        self.bindings = set()
+
+
+class FakeSwitchDriver(SwitchDriverBase):
+    """A switch driver keeping the switches in memory.
+
+    Select it in [switchs], e.g. h3c=torconf.fake.FakeSwitchDriver, to
+    run sapi without switches. Every call is recorded in calls as
+    (mgr, method, args) and takes [fake] call_delay seconds.
+    """
+
+    def __init__(self):
+        self._local = corolocal.local()
+        self.switches = collections.defaultdict(_FakeSwitch)
+        self.calls = []
+
+    @property
+    def mgr(self):
+        return getattr(self._local, 'mgr', None)
+
+    @property
+    def switch(self):
+        return self.switches[self.mgr]
+
+    def _call(self, method, *args):
+        self.calls.append((self.mgr, method, args))
+        delay = CONF.fake.call_delay
+        if CONF.fake.call_jitter:
+            delay += random.uniform(-CONF.fake.call_jitter, CONF.fake.call_jitter)
+        eventlet.sleep(max(delay, 0))
+
+    def initialize(self, mgr, user, passwd):
+        self._local.mgr = mgr
+        self._call('initialize', mgr)
+        return True
+
+    def newtunnel(self, src, dst):
+        self._call('newtunnel', src, dst)
+        tunnels = self.switch.tunnels
+        tunnel_id = 1
+        while tunnel_id in tunnels:
+            tunnel_id += 1
+        tunnels[tunnel_id] = (src, dst)
+        return True, tunnel_id
+
+    def deletetunnel(self, tunnel_id):
+        self._call('deletetunnel', tunnel_id)
+        self.switch.tunnels.pop(tunnel_id, None)
+        self.switch.bindings = set(b for b in self.switch.bindings
+                                   if b[1] != tunnel_id)
+        return True
+
+    def newvlan2vxlan(self, ifindex, vlan, vxlan):
+        self._call('newvlan2vxlan', ifindex, vlan, vxlan)
+        self.switch.ports[(ifindex, vlan)] = vxlan
+        self.switch.vxlans.add(vxlan)
+        return True
+
+    def deletevlan2vxlan(self, ifindex, vlan, vxlan, only_index=False):
+        self._call('deletevlan2vxlan', ifindex, vlan, vxlan, only_index)
+        self.switch.ports.pop((ifindex, vlan), None)
+        if not only_index:
+            self.switch.vxlans.discard(vxlan)
+            self.switch.bindings = set(b for b in self.switch.bindings
+                                       if b[0] != vxlan)
+        return True
+
+    def ensureVxlanWithTunnel(self, vxlans, tunnel_ids):
+        self._call('ensureVxlanWithTunnel', vxlans, tunnel_ids)
+        for vxlan in vxlans:
+            for tunnel_id in tunnel_ids:
+                self.switch.bindings.add((vxlan, tunnel_id))
+        return True
+
+    def reconcile(self, desired):
+        self._call('reconcile', desired)
+        switch = self.switch
+        bindings = set((vxlan, tunnel_id) for vxlan in desired["vxlans"]
+                       for tunnel_id in desired["tunnels"])
+        created = (["Tunnel%s" %((id,),) for id in desired["tunnels"]
+                    if id not in switch.tunnels] +
+                   ["Vxlan%s" %((vxlan,),) for vxlan in desired["vxlans"]
+                    if vxlan not in switch.vxlans] +
+                   ["AC%s" %(key,) for key in desired["ports"]
+                    if key not in switch.ports] +
+                   ["Tunnel%s" %(b,) for b in bindings - switch.bindings])
+        switch.tunnels.update(desired["tunnels"])
+        switch.vxlans |= desired["vxlans"]
+        switch.ports.update(desired["ports"])
+        switch.bindings |= bindings
+        return {"created": created, "removed": [], "failed": [], "conflicts": []}
+
+    def begin(self):
+        self._call('begin')
+
+    def commit(self):
+        self._call('commit')
+        return True
+
+    def rollback(self):
+        self._call('rollback')
@@ -1,330 +1,949 @@
+import io
+import re
+import copy
 import time
+import collections
+import contextlib
+
 import lxml.etree as etree
-from ncclient import manager
+from eventlet import corolocal
+from ncclient.operations import RPCError
+from oslo.config import cfg
 
+from torconf.base import ConfigFailError
 from torconf.base import SwitchDriverBase
+from torconf import metrics
+from torconf import models_lv
+from torconf import netconf
+from torconf import utils
+
+h3c_opts = [
+    cfg.IntOpt('tunnel_bind_chunk_size', default=500,
+               help="Number of vxlan to tunnel bindings sent in one edit-config"),
+    cfg.BoolOpt('use_candidate', default=False,
+                help="Stage the edits of an API operation in the candidate "
+                     "datastore and commit them once"),
+    cfg.IntOpt('pipeline_window', default=1,
+               help="Number of edit-configs of a batch sent on one session "
+                    "before their replies are waited for, 1 waits for "
+                    "every reply before sending the next"),
+    cfg.IntOpt('fragment_cache_size', default=4096,
+               help="Number of rendered edit-config entries kept for reuse"),
+    cfg.BoolOpt('reconcile_prune', default=False,
+                help="Let reconciliation remove vsis, vxlans, tunnels and "
+                     "ports the database does not know about"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(h3c_opts, group='h3c')
+
+MERGE = "merge"
+REMOVE = "remove"
+
+NC_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+CONFIG_NS = "http://www.h3c.com/netconf/config:1.0"
+
+#the class level entry templates rendered through _Template.
+_ROW_TEMPLATES = ['vsi_xml', 'create_vxlan_xml', 'delete_vxlan_xml',
+                  'edit_vxlan_xml', 'delete_vxlan_tunnel_xml',
+                  'create_tunnel_xml', 'delete_tunnel_xml',
+                  'create_ac_xml', 'delete_ac_xml',
+                  'create_service_xml', 'delete_service_xml']
+
+#a single table entry of an edit-config, the composer groups entries
+#by module and table so that many of them travel in one document.
+_Row = collections.namedtuple('_Row', ['module', 'table', 'tag', 'keys', 'xml'])
+
+#order in which the tables of a batch are created, removal goes backwards.
+_TABLE_ORDER = [('TUNNEL', 'Tunnels'),
+                ('L2VPN', 'VSIs'),
+                ('L2VPN', 'SRVs'),
+                ('L2VPN', 'ACs'),
+                ('VXLAN', 'VXLANs'),
+                ('VXLAN', 'Tunnels')]
+_MODULES = frozenset(module for module, _ in _TABLE_ORDER)
+
+#table entries read back by reconciliation, as (module, table, entry).
+_STATE_ROWS = [('L2VPN', 'VSIs', 'VSI'),
+               ('L2VPN', 'SRVs', 'SRV'),
+               ('L2VPN', 'ACs', 'AC'),
+               ('VXLAN', 'VXLANs', 'Vxlan'),
+               ('VXLAN', 'Tunnels', 'Tunnel'),
+               ('TUNNEL', 'Tunnels', 'Tunnel')]
+
+#names and values in the error-path and error-info of an rpc-error.
+_TOKEN = re.compile(r"[\w.:-]+")
+
+def _local(tag):
+    """Strip the namespace off an element tag."""
+    if not isinstance(tag, basestring):
+        return None
+    return tag.rpartition('}')[2]
+
+def _stream(raw, tags):
+    """Yield the elements of a raw reply whose local tag is in tags, in
+    document order, as soon as each one is parsed.
+
+    An element yielded is cleared, with the siblings parsed before it,
+    once the caller asks for the next one, so the tree never holds more
+    than the entry at hand however large the reply. An rpc-error is
+    raised as RPCError.
+    """
+    matched = ["{*}" + tag for tag in tags] + ["{%s}rpc-error" %(NC_NS)]
+    context = etree.iterparse(io.BytesIO(raw), events=("end",), tag=matched,
+                              remove_blank_text=True, huge_tree=True)
+    for _, e in context:
+        if e.tag == "{%s}rpc-error" %(NC_NS):
+            error = RPCError(e)
+            if error.severity == "error":
+                raise error
+        else:
+            yield e
+        e.clear()
+        parent = e.getparent()
+        while e.getprevious() is not None:
+            del parent[0]
+    del context
+
+class _Template(object):
+    """A table entry parsed once, rendered by filling in its {fields}.
+
+    The entry is kept under a <top> declaring the namespaces, so the
+    rendered fragment goes without declarations of its own. lxml escapes
+    the values.
+    """
+
+    _parser = etree.XMLParser(remove_blank_text=True)
+
+    def __init__(self, xml):
+        self.top = etree.fromstring('<top xmlns="%s" xmlns:xc="%s">%s</top>'
+                                    %(CONFIG_NS, NC_NS, xml), self._parser)
+        #(path of child indexes, attribute or None for the text, field)
+        self.slots = []
+        self._find_slots(self.top[0], (0,))
+        self.fields = tuple(field for _, _, field in self.slots)
+
+    def _find_slots(self, element, path):
+        for name, value in element.attrib.items():
+            if value.startswith('{') and value.endswith('}'):
+                self.slots.append((path, name, value[1:-1]))
+        text = (element.text or '').strip()
+        if text.startswith('{') and text.endswith('}'):
+            self.slots.append((path, None, text[1:-1]))
+        for i, child in enumerate(element):
+            self._find_slots(child, path + (i,))
+
+    def render(self, values):
+        top = copy.deepcopy(self.top)
+        for path, attr, field in self.slots:
+            element = top
+            for i in path:
+                element = element[i]
+            if attr:
+                element.set(attr, str(values[field]))
+            else:
+                element.text = str(values[field])
+        xml = etree.tostring(top)
+        return xml[xml.index('>') + 1:xml.rindex('<')]
+
+class _FragmentCache(object):
+    """Rendered entries by template and values.
+
+    Once size entries are kept the least recently used half is dropped,
+    which keeps a hit down to a dict lookup.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._fragments = {}
+        self._tick = 0
+
+    def get(self, key, template, values):
+        if self.size <= 0:
+            return template.render(values)
+        self._tick += 1
+        entry = self._fragments.get(key)
+        if entry is None:
+            if len(self._fragments) >= self.size:
+                self._evict()
+            entry = self._fragments[key] = [template.render(values), 0]
+        entry[1] = self._tick
+        return entry[0]
+
+    def _evict(self):
+        entries = sorted(self._fragments.items(), key=lambda item: item[1][1])
+        for key, _ in entries[:len(entries) / 2 + 1]:
+            del self._fragments[key]
+
+class _Transaction(object):
+    """A session pinned to one switch while its candidate is being edited."""
+
+    def __init__(self, session, conn):
+        self.session = session
+        self.conn = conn
+        self.tunnel_ids = []
+        #ids of tunnels deleted in the candidate, free once committed.
+        self.released_ids = []
+
+class TunnelIDAllocator(object):
+    """Hands out the tunnel ids of one switch from memory.
+
+    It starts at the first free id the switch reported and skips the ids
+    known to be in use, either on the switch or in sapi_tor_tunnels.
+    """
+
+    def __init__(self, first, used):
+        self.first = first
+        self.used = set(used)
+
+    def allocate(self):
+        id = self.first
+        while id in self.used:
+            id += 1
+        self.used.add(id)
+        return id
+
+    def release(self, id):
+        self.used.discard(id)
+        self.first = min(self.first, id)
 
 class H3CNetConfDriver(SwitchDriverBase):
-    vsi_xml = """
+    config_xml = """
         <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
          xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-          <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <L2VPN xc:operation="{operation}">
-              <VSIs>
-                <VSI>
-                  <VsiName>{vsiname}</VsiName>
-                </VSI>
-              </VSIs>
-            </L2VPN>
-          </top>
+          <top xmlns="http://www.h3c.com/netconf/config:1.0">{modules}</top>
         </config>
     """
+    module_xml = """
+            <{module}>{tables}</{module}>"""
+    table_xml = """
+              <{table}>{rows}</{table}>"""
+    vsi_xml = """
+                <VSI xc:operation="{operation}">
+                  <VsiName>{vsiname}</VsiName>
+                </VSI>"""
     create_vxlan_xml = """
-        <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-         xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-          <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <VXLAN xc:operation="merge">
-              <VXLANs>
-                  <Vxlan>
-                      <VxlanID>{vxlanid}</VxlanID>
-                      <VsiName>{vsiname}</VsiName>
-                  </Vxlan>
-              </VXLANs>
-            </VXLAN>
-          </top>
-        </config>
-    """
+                <Vxlan xc:operation="merge">
+                  <VxlanID>{vxlanid}</VxlanID>
+                  <VsiName>{vsiname}</VsiName>
+                </Vxlan>"""
     delete_vxlan_xml = """
-        <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-         xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-          <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <VXLAN xc:operation="remove">
-              <VXLANs>
-                  <Vxlan>
-                      <VxlanID>{vxlanid}</VxlanID>
-                  </Vxlan>
-              </VXLANs>
-            </VXLAN>
-          </top>
-        </config>
-    """
+                <Vxlan xc:operation="remove">
+                  <VxlanID>{vxlanid}</VxlanID>
+                </Vxlan>"""
     edit_vxlan_xml = """
-        <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-         xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-          <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <VXLAN xc:operation="merge">
-              <Tunnels>
-                  <Tunnel>
-                      <VxlanID>{vxlanid}</VxlanID>
-                      <TunnelID>{tunnelid}</TunnelID>
-                  </Tunnel>
-              </Tunnels>
-            </VXLAN>
-          </top>
-        </config>
-    """
+                <Tunnel xc:operation="merge">
+                  <VxlanID>{vxlanid}</VxlanID>
+                  <TunnelID>{tunnelid}</TunnelID>
+                </Tunnel>"""
+    delete_vxlan_tunnel_xml = """
+                <Tunnel xc:operation="remove">
+                  <VxlanID>{vxlanid}</VxlanID>
+                  <TunnelID>{tunnelid}</TunnelID>
+                </Tunnel>"""
     create_tunnel_xml = """
-        <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-         xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-          <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <TUNNEL xc:operation="merge">
-              <Tunnels>
-                  <Tunnel>
-                      <ID>{tunnel_id}</ID>
-                      <Mode>24</Mode>
-                      <IPv4Addr>
-                          <SrcAddr>{src_addr}</SrcAddr>
-                          <DstAddr>{dst_addr}</DstAddr>
-                      </IPv4Addr>
-                  </Tunnel>
-              </Tunnels>
-            </TUNNEL>
-          </top>
-        </config>
-    """
+                <Tunnel xc:operation="create">
+                  <ID>{tunnel_id}</ID>
+                  <Mode>24</Mode>
+                  <IPv4Addr>
+                    <SrcAddr>{src_addr}</SrcAddr>
+                    <DstAddr>{dst_addr}</DstAddr>
+                  </IPv4Addr>
+                </Tunnel>"""
     delete_tunnel_xml = """
-        <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-         xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-          <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <TUNNEL xc:operation="remove">
-              <Tunnels>
-                  <Tunnel>
-                      <ID>{tunnel_id}</ID>
-                  </Tunnel>
-              </Tunnels>
-            </TUNNEL>
-          </top>
-        </config>
-    """
+                <Tunnel xc:operation="remove">
+                  <ID>{tunnel_id}</ID>
+                </Tunnel>"""
     create_ac_xml = """
-    <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-     xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-        <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <L2VPN xc:operation="merge">
-                <ACs>
-                    <AC>
-                        <IfIndex>{if_index}</IfIndex>
-                        <SrvID>{service_id}</SrvID>
-                        <VsiName>{vsi_name}</VsiName>
-                    </AC>
-                </ACs>
-            </L2VPN>
+                <AC xc:operation="merge">
+                  <IfIndex>{if_index}</IfIndex>
+                  <SrvID>{service_id}</SrvID>
+                  <VsiName>{vsi_name}</VsiName>
+                </AC>"""
+    delete_ac_xml = """
+                <AC xc:operation="remove">
+                  <IfIndex>{if_index}</IfIndex>
+                  <SrvID>{service_id}</SrvID>
+                </AC>"""
+    create_service_xml = """
+                <SRV xc:operation="merge">
+                  <IfIndex>{if_index}</IfIndex>
+                  <SrvID>{service_id}</SrvID>
+                  <Encap>4</Encap>
+                  <SVlanRange>{s_vid}</SVlanRange>
+                </SRV>"""
+    delete_service_xml = """
+                <SRV xc:operation="remove">
+                  <IfIndex>{if_index}</IfIndex>
+                  <SrvID>{service_id}</SrvID>
+                </SRV>"""
+    RETRIEVE_TUNNEL_IDS = """
+        <top xmlns="http://www.h3c.com/netconf/data:1.0">
+            <TUNNEL>
+                <AvailableTunnelID>
+                </AvailableTunnelID>
+                <Tunnels>
+                    <Tunnel>
+                        <ID></ID>
+                    </Tunnel>
+                </Tunnels>
+            </TUNNEL>
         </top>
-    </config>
     """
-    delete_ac_xml = """
-    <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-     xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-        <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <L2VPN xc:operation="remove">
-                <ACs>
-                    <AC>
-                        <IfIndex>{if_index}</IfIndex>
-                        <SrvID>{service_id}</SrvID>
-                    </AC>
-                </ACs>
-            </L2VPN>
+    RETRIEVE_HOSTNAME = """
+        <top xmlns="http://www.h3c.com/netconf/data:1.0">
+            <Device>
+                <Base>
+                    <HostName></HostName>
+                </Base>
+            </Device>
         </top>
-    </config>
     """
-    create_service_xml = """
-    <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-     xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
-        <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <L2VPN xc:operation="merge">
-                <SRVs>
-                    <SRV>
-                        <IfIndex>{if_index}</IfIndex>
-                        <SrvID>{service_id}</SrvID>
-                        <Encap>4</Encap>
-                        <SVlanRange>{s_vid}</SVlanRange>
-                    </SRV>
-                </SRVs>
-            </L2VPN>
+    RETRIEVE_LLDP = """
+        <top xmlns="http://www.h3c.com/netconf/data:1.0">
+            <LLDP>
+                <LocalSystem></LocalSystem>
+                <LocalPorts></LocalPorts>
+                <Neighbors></Neighbors>
+            </LLDP>
         </top>
-    </config>
     """
-    delete_service_xml = """
-    <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
-     xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0">
+    RETRIEVE_STATE = """
         <top xmlns="http://www.h3c.com/netconf/config:1.0">
-            <L2VPN xc:operation="remove">
-                <SRVs>
-                    <SRV>
-                        <IfIndex>{if_index}</IfIndex>
-                        <SrvID>{service_id}</SrvID>
-                    </SRV>
-                </SRVs>
+            <L2VPN>
+                <VSIs></VSIs>
+                <SRVs></SRVs>
+                <ACs></ACs>
             </L2VPN>
-        </top>
-    </config>
-    """
-    RETRIEVE_AVAILABLE_TUNNEL_ID = """
-        <top xmlns="http://www.h3c.com/netconf/data:1.0">
-            <TUNNEL xmlns:web="http://www.h3c.com/netconf/base:1.0">
-                    <AvailableTunnelID>
-                    </AvailableTunnelID>
+            <VXLAN>
+                <VXLANs></VXLANs>
+                <Tunnels></Tunnels>
+            </VXLAN>
+            <TUNNEL>
+                <Tunnels></Tunnels>
             </TUNNEL>
         </top>
     """
     def __init__(self):
-        self.conn = {}
-        self.mgr = None
-        self.user= None
-        self.passwd = None
-        self.timestamp = time.time()
+        #switch requests may run concurrently, each green thread works
+        #on the tor it initialized.
+        self._local = corolocal.local()
+        self._txns = {}
+        self._tunnel_ids = {}
+        self._templates = dict((name, _Template(getattr(self, name)))
+                               for name in _ROW_TEMPLATES)
+        self._fragments = _FragmentCache(CONF.h3c.fragment_cache_size)
+        self.pool = netconf.SessionPool(probe=self._probe)
+        self.pool.start_keepalive()
+
+    @property
+    def mgr(self):
+        return getattr(self._local, 'mgr', None)
+
+    @mgr.setter
+    def mgr(self, mgr):
+        self._local.mgr = mgr
+
+    def _probe(self, mgr, conn):
+        self._rpc(conn, 'probe', 'get', mgr=mgr,
+                  filter=('subtree', self.RETRIEVE_HOSTNAME))
+
+    def _rpc(self, conn, operation, method, mgr=None, **kwargs):
+        """Call an RPC on conn, recording its latency, reply size and
+        errors per switch and operation."""
+        mgr = mgr or self.mgr
+        with metrics.timer('netconf_rpc_seconds', mgr, operation,
+                           errors='netconf_errors'):
+            #ncclient waits for the reply on a native event, which would
+            #stop the hub.
+            ret = utils.offload(getattr(conn, method), **kwargs)
+        metrics.observe('netconf_reply_bytes', mgr, operation, len(ret.xml))
+        return ret
+
+    def _fetch(self, conn, operation, method, **kwargs):
+        """Call a get or get-config on conn and return the raw reply,
+        left unparsed: ncclient would build the whole tree of it."""
+        started = time.time()
+        conn.async_mode = True
+        try:
+            rpc = getattr(conn, method)(**kwargs)
+        finally:
+            conn.async_mode = False
+        utils.offload(rpc.event.wait, conn.timeout)
+        metrics.observe('netconf_rpc_seconds', self.mgr, operation,
+                        time.time() - started)
+        if not rpc.event.isSet() or rpc.error:
+            metrics.increment('netconf_errors', self.mgr, operation)
+            raise rpc.error or IOError("%s on %s timed out" %(method, self.mgr))
+        raw = rpc.reply.xml
+        metrics.observe('netconf_reply_bytes', self.mgr, operation, len(raw))
+        return raw
+
+    def _read(self, operation, method, tags, **kwargs):
+        """Yield the elements tagged tags of a get or get-config reply,
+        see _stream."""
+        with self._session() as (conn, target):
+            raw = self._fetch(conn, operation, method, **kwargs)
+        try:
+            for e in _stream(raw, tags):
+                yield e
+        except RPCError:
+            metrics.increment('netconf_errors', self.mgr, operation)
+            raise
 
     def initialize(self, mgr, user, passwd):
-        self.mgr, self.user, self.passwd = mgr, user, passwd
-        if self.mgr not in self.conn:
-            self.conn[mgr] = None
-        now = time.time()
-        expired = int(now - self.timestamp)
-        if not self.conn[self.mgr] or expired > 30:
-            try:
-                self.conn[self.mgr] = manager.connect_ssh(host = self.mgr,
-                                            username = self.user,
-                                            password = self.passwd,
-                                            hostkey_verify = False,
-                                            look_for_keys=False)
-                self.timestamp = time.time()
-            except Exception as e:
-                print str(e)
-                return False
-        return True
-
-    def _check_resp(self, ret):
-        if 'ok' in ret.xml:
-            return True
+        self.mgr = mgr
+        self.pool.register(mgr, user, passwd)
+        return self.pool.warm(mgr)
+
+    @contextlib.contextmanager
+    def _session(self):
+        """Yield the session and target datastore edits should go to."""
+        txn = self._txns.get(self.mgr)
+        if txn:
+            yield txn.conn, 'candidate'
         else:
-            return False
-
-    def _operation(self, xml):
+            with self.pool.session(self.mgr) as conn:
+                yield conn, 'running'
+
+    def begin(self):
+        if not CONF.h3c.use_candidate:
+            return
+        if self.mgr in self._txns:
+            raise ConfigFailError("tor %s has a transaction open" %(self.mgr))
+        session = self.pool.session(self.mgr)
         try:
-            ret = self.conn[self.mgr].edit_config(target='running', config=xml)
-            return self._check_resp(ret)
-        except:
-            return False
-
-    def  _create_vsi_xml(self, name):
-        return self.vsi_xml.format(operation="merge", vsiname=name)
-
-    def _delete_vsi_xml(self, name):
-        return self.vsi_xml.format(operation="remove", vsiname=name)
-
-    def _create_vsi(self, name):
-        return self._operation(self._create_vsi_xml(name))
-
-    def _delete_vsi(self, name):
-        return self._operation(self._delete_vsi_xml(name))
+            conn = session.__enter__()
+        except Exception as e:
+            raise ConfigFailError("tor %s: %s" %(self.mgr, e))
+        try:
+            self._rpc(conn, 'lock', 'lock', target='candidate')
+            #start from the running config, not from a stale candidate.
+            self._rpc(conn, 'discard_changes', 'discard_changes')
+        except Exception as e:
+            session.__exit__(None, None, None)
+            raise ConfigFailError("tor %s: candidate lock failed: %s" %(self.mgr, e))
+        self._txns[self.mgr] = _Transaction(session, conn)
 
-    def _create_vxlan_xml(self, vxlan, name):
-        return self.create_vxlan_xml.format(vxlanid=vxlan, vsiname=name)
+    def in_transaction(self):
+        return self.mgr in self._txns
 
-    def _delete_vxlan_xml(self, vxlan):
-        return self.delete_vxlan_xml.format(vxlanid=vxlan)
+    def forget(self, mgr):
+        #a tor added again at mgr starts from the ids the switch reports.
+        self._tunnel_ids.pop(mgr, None)
+        self.pool.close(mgr)
 
-    def _create_vxlan(self, vxlan, name):
-        return self._operation(self._create_vxlan_xml(vxlan, name))
+    def _end(self, apply):
+        txn = self._txns.pop(self.mgr, None)
+        if txn is None:
+            return True
+        ok = apply
+        try:
+            if apply:
+                try:
+                    self._rpc(txn.conn, 'commit', 'commit')
+                except Exception as e:
+                    print "commit on %s failed: %s" %(self.mgr, e)
+                    ok = False
+            allocator = self._tunnel_ids.get(self.mgr)
+            if allocator:
+                for id in (txn.released_ids if ok else txn.tunnel_ids):
+                    allocator.release(id)
+            if not ok:
+                try:
+                    self._rpc(txn.conn, 'discard_changes', 'discard_changes')
+                except Exception as e:
+                    print "closing transaction on %s failed: %s" %(self.mgr, e)
+            try:
+                self._rpc(txn.conn, 'unlock', 'unlock', target='candidate')
+            except Exception as e:
+                #the lock goes away with the session, which must not be
+                #handed out again.
+                print "unlocking candidate of %s failed: %s" %(self.mgr, e)
+                self.pool.drop(txn.conn)
+        finally:
+            txn.session.__exit__(None, None, None)
+        return ok
 
-    def _delete_vxlan(self, vxlan):
-        return self._operation(self._delete_vxlan_xml(vxlan))
+    def commit(self):
+        return self._end(True)
 
-    def _edit_vxlan_xml(self, vxlan, tunnel_id):
-        return self.edit_vxlan_xml.format(vxlanid=vxlan, tunnelid=tunnel_id)
+    def rollback(self):
+        self._end(False)
 
-    def _edit_vxlan_tunnel(self, vxlan, tunnel_id):
-        return self._operation(self._edit_vxlan_xml(vxlan, tunnel_id))
+    def _check_resp(self, ret):
+        """Whether the reply carries no rpc-error, as ncclient found
+        parsing it once: a switch sends <ok/> only without errors or
+        warnings."""
+        return ret.ok
+
+    def _render(self, name, **values):
+        template = self._templates[name]
+        key = (name,) + tuple([values[field] for field in template.fields])
+        return self._fragments.get(key, template, values)
+
+    def _compose(self, rows):
+        """Merge table entries into one <config> document.
+
+        Modules and tables keep the order in which they first show up
+        in rows, so the caller decides what the switch applies first.
+        """
+        modules, tables, entries = [], {}, {}
+        for row in rows:
+            key = (row.module, row.table)
+            xmls = entries.get(key)
+            if xmls is None:
+                xmls = entries[key] = []
+                if row.module not in tables:
+                    modules.append(row.module)
+                    tables[row.module] = []
+                tables[row.module].append(row.table)
+            xmls.append(row.xml)
+        return self.config_xml.format(modules=''.join(
+            self.module_xml.format(module=module, tables=''.join(
+                self.table_xml.format(table=table, rows=''.join(entries[(module, table)]))
+                for table in tables[module]))
+            for module in modules))
+
+    def _row_failed(self, row, error):
+        where = set(_TOKEN.findall("%s %s" %(error.path or '', error.info or '')))
+        if row.tag not in where:
+            return False
+        #entries of one name live in several tables, e.g. Tunnel in TUNNEL
+        #and VXLAN, a path naming its module has to name the row's.
+        path = set(_TOKEN.findall(error.path or ''))
+        if path & _MODULES and not (row.module in path and row.table in path):
+            return False
+        return all(str(key) in where for key in row.keys)
 
-    def _create_tunnel_xml(self, tunnel_id, src, dst):
-        return self.create_tunnel_xml.format(tunnel_id=tunnel_id, src_addr=src, dst_addr=dst)
+    def _edit(self, rows, operation='edit_config'):
+        """Send rows in a single edit-config, return the rows that failed.
 
-    def _delete_tunnel_xml(self, tunnel_id):
-        return self.delete_tunnel_xml.format(tunnel_id=tunnel_id)
+        The switch keeps going past a failing entry, the rpc-errors of the
+        reply are then matched against the entries by their error-path.
+        An error which can not be matched fails every entry.
+        """
+        if not rows:
+            return []
+        try:
+            with self._session() as (conn, target):
+                ret = self._rpc(conn, operation, 'edit_config',
+                                target=target,
+                                config=self._compose(rows),
+                                error_option='continue-on-error')
+            if self._check_resp(ret):
+                return []
+            metrics.increment('netconf_errors', self.mgr, operation)
+            errors = ret.errors
+        except RPCError as e:
+            errors = e.errlist or [e]
+        except Exception as e:
+            print "edit-config on %s failed: %s" %(self.mgr, e)
+            return list(rows)
+        return self._failed_rows(rows, errors)
+
+    def _failed_rows(self, rows, errors):
+        failed = [row for row in rows
+                  if any(self._row_failed(row, error) for error in errors)]
+        return failed or list(rows)
+
+    def _edit_chunks(self, chunks, operation='edit_config'):
+        """Send every chunk of rows in an edit-config of its own, return
+        the rows that failed.
+
+        With pipeline_window above 1 that many edit-configs are kept in
+        flight on one session, ncclient matches the replies to them by
+        message-id. The switch still applies them in the order sent.
+        """
+        window = CONF.h3c.pipeline_window
+        if window <= 1 or len(chunks) <= 1:
+            failed = []
+            for rows in chunks:
+                failed.extend(self._edit(rows, operation))
+            return failed
+        failed, pending, sent = [], collections.deque(), 0
+        try:
+            with self._session() as (conn, target):
+                for rows in chunks:
+                    pending.append((rows, self._send_edit(conn, target, rows),
+                                    time.time(), conn.timeout))
+                    sent += 1
+                    if len(pending) >= window:
+                        #a chunk leaves pending once its reply is in,
+                        #else the except below fails its rows.
+                        failed.extend(self._collect_edit(operation, *pending[0]))
+                        pending.popleft()
+                while pending:
+                    failed.extend(self._collect_edit(operation, *pending[0]))
+                    pending.popleft()
+        except Exception as e:
+            print "edit-config on %s failed: %s" %(self.mgr, e)
+            metrics.increment('netconf_errors', self.mgr, operation)
+            for rows in [p[0] for p in pending] + chunks[sent:]:
+                failed.extend(rows)
+        return failed
+
+    def _send_edit(self, conn, target, rows):
+        """Put an edit-config on the wire without waiting for its reply."""
+        conn.async_mode = True
+        try:
+            return conn.edit_config(target=target,
+                                    config=self._compose(rows),
+                                    error_option='continue-on-error')
+        finally:
+            conn.async_mode = False
+
+    def _collect_edit(self, operation, rows, rpc, started, timeout):
+        utils.offload(rpc.event.wait, timeout)
+        metrics.observe('netconf_rpc_seconds', self.mgr, operation,
+                        time.time() - started)
+        if not rpc.event.isSet() or rpc.error:
+            print "edit-config on %s failed: %s" %(self.mgr, rpc.error or "timed out")
+            metrics.increment('netconf_errors', self.mgr, operation)
+            return list(rows)
+        reply = rpc.reply
+        metrics.observe('netconf_reply_bytes', self.mgr, operation, len(reply.xml))
+        if self._check_resp(reply):
+            return []
+        metrics.increment('netconf_errors', self.mgr, operation)
+        return self._failed_rows(rows, reply.errors)
+
+    def _operation(self, rows, operation='edit_config'):
+        return not self._edit(rows, operation)
+
+    def _vsi_row(self, name, operation):
+        return _Row('L2VPN', 'VSIs', 'VSI', (name,),
+                    self._render('vsi_xml', operation=operation, vsiname=name))
+
+    def _create_vxlan_row(self, vxlan, name):
+        return _Row('VXLAN', 'VXLANs', 'Vxlan', (vxlan,),
+                    self._render('create_vxlan_xml', vxlanid=vxlan, vsiname=name))
+
+    def _delete_vxlan_row(self, vxlan):
+        return _Row('VXLAN', 'VXLANs', 'Vxlan', (vxlan,),
+                    self._render('delete_vxlan_xml', vxlanid=vxlan))
+
+    def _edit_vxlan_row(self, vxlan, tunnel_id):
+        return _Row('VXLAN', 'Tunnels', 'Tunnel', (vxlan, tunnel_id),
+                    self._render('edit_vxlan_xml', vxlanid=vxlan, tunnelid=tunnel_id))
+
+    def _edit_vxlan_tunnels(self, pairs):
+        """Bind (vxlan, tunnel_id) pairs in chunks, return the failed pairs."""
+        size = max(CONF.h3c.tunnel_bind_chunk_size, 1)
+        rows = [self._edit_vxlan_row(vxlan, tunnel_id) for vxlan, tunnel_id in pairs]
+        chunks = [rows[start:start + size] for start in range(0, len(rows), size)]
+        return [row.keys for row in self._edit_chunks(chunks, 'edit_vxlan_tunnel')]
+
+    def _create_tunnel_row(self, tunnel_id, src, dst):
+        return _Row('TUNNEL', 'Tunnels', 'Tunnel', (tunnel_id,),
+                    self._render('create_tunnel_xml', tunnel_id=tunnel_id, src_addr=src, dst_addr=dst))
+
+    def _delete_tunnel_row(self, tunnel_id):
+        return _Row('TUNNEL', 'Tunnels', 'Tunnel', (tunnel_id,),
+                    self._render('delete_tunnel_xml', tunnel_id=tunnel_id))
 
     def _create_tunnel(self, tunnel_id, src, dst):
-        return self._operation(self._create_tunnel_xml(tunnel_id, src, dst))
+        return self._operation([self._create_tunnel_row(tunnel_id, src, dst)],
+                               'create_tunnel')
 
     def _delete_tunnel(self, tunnel_id):
-        return self._operation(self._delete_tunnel_xml(tunnel_id))
-
-    def _create_port_ac_xml(self, index, service_id, vsiname):
-        return self.create_ac_xml.format(if_index=index, service_id=service_id, vsi_name=vsiname)
-
-    def _delete_port_ac_xml(self, index, service_id):
-        return self.delete_ac_xml.format(if_index=index, service_id=service_id)
-
-    def _create_port_ac(self, index, service_id, vsiname):
-        return self._operation(self._create_port_ac_xml(index, service_id, vsiname))
-
-    def _delete_port_ac(self, index, service_id):
-        return self._operation(self._delete_port_ac_xml(index, service_id))
-
-    def _create_service_xml(self, index, service_id, s_vid):
-        return self.create_service_xml.format(if_index=index, service_id=service_id, s_vid=s_vid)
-
-    def _delete_service_xml(self, index, service_id):
-        return self.delete_service_xml.format(if_index=index, service_id=service_id)
-
-    def _create_service(self, index, service_id, s_vid):
-        return self._operation(self._create_service_xml(index, service_id, s_vid))
-
-    def _delete_service(self, index, service_id):
-        return self._operation(self._delete_service_xml(index, service_id))
-
-    def _get_avaliable_tunnel_id(self):
-        id = -1
-        def replace_id(s):
-            s1 = s.replace('<ID>', '')
-            return s1.replace('</ID>', '')
+        return self._operation([self._delete_tunnel_row(tunnel_id)], 'delete_tunnel')
+
+    def _create_port_ac_row(self, index, service_id, vsiname):
+        return _Row('L2VPN', 'ACs', 'AC', (index, service_id),
+                    self._render('create_ac_xml', if_index=index, service_id=service_id, vsi_name=vsiname))
+
+    def _delete_port_ac_row(self, index, service_id):
+        return _Row('L2VPN', 'ACs', 'AC', (index, service_id),
+                    self._render('delete_ac_xml', if_index=index, service_id=service_id))
+
+    def _create_service_row(self, index, service_id, s_vid):
+        return _Row('L2VPN', 'SRVs', 'SRV', (index, service_id),
+                    self._render('create_service_xml', if_index=index, service_id=service_id, s_vid=s_vid))
+
+    def _delete_service_row(self, index, service_id):
+        return _Row('L2VPN', 'SRVs', 'SRV', (index, service_id),
+                    self._render('delete_service_xml', if_index=index, service_id=service_id))
+
+    def _report(self, action, failed):
+        for row in failed:
+            print "%s: %s %s failed on tor %s" %(action, row.tag, row.keys, self.mgr)
+
+    def _get_tunnel_ids(self):
+        """Ask the switch for its first free tunnel id and the ids in use."""
+        available, used = -1, set()
+        for e in self._read('get_tunnel_ids', 'get', ('ID',),
+                            filter=('subtree', self.RETRIEVE_TUNNEL_IDS)):
+            if _local(e.getparent().tag) == 'AvailableTunnelID':
+                available = int(e.text)
+            else:
+                used.add(int(e.text))
+        return available, used
+
+    def lldp(self):
+        """Read the LLDP local system, local ports and neighbours of the
+        switch over its pooled session."""
+        local, remote = {"indexs": {}, "mgrs": {}}, {}
+        for e in self._read('get_lldp', 'get', ('LocalSystem', 'Port', 'Neighbor'),
+                            filter=('subtree', self.RETRIEVE_LLDP)):
+            fields = dict((_local(c.tag), c.text) for c in e)
+            if _local(e.tag) == 'LocalSystem':
+                local["mac"] = fields.get("ChassisID")
+                local["sysname"] = fields.get("SystemName")
+                local["desc"] = fields.get("SystemDescription")
+            elif _local(e.tag) == 'Port':
+                local["indexs"][int(fields["IfIndex"])] = fields.get("PortID")
+            else:
+                remote[int(fields["IfIndex"])] = {
+                        "mac": fields.get("ChassisID"),
+                        "desc": fields.get("PortDescription"),
+                        "hostname": fields.get("SystemName"),
+                        "hostdesc": fields.get("SystemDescription"),
+                        "ip": fields.get("ManagementAddress")}
+        return local, remote
+
+    def _tunnel_allocator(self, reseed=False):
+        allocator = self._tunnel_ids.get(self.mgr)
+        if allocator and not reseed:
+            return allocator
         try:
-            configstr = self.RETRIEVE_AVAILABLE_TUNNEL_ID
-            ret = self.conn[self.mgr].get(filter=('subtree', configstr))
-            x = etree.fromstring(ret.data_xml)
-            lines = etree.tostring(x, pretty_print = True).split('\n')
-            _lines = [line.strip() for line in lines]
-            for line in _lines:
-                if line.startswith('<ID>'):
-                    id = replace_id(line)
+            available, used = self._get_tunnel_ids()
         except Exception as e:
-            print str(e)
-        return int(id)
+            print "reading tunnel ids of tor %s failed: %s" %(self.mgr, e)
+            return None
+        if available == -1:
+            return None
+        if allocator:
+            #keep what was handed out, the switch may not have it yet.
+            used |= allocator.used
+        else:
+            used |= set(t["tunnel_id"] for t in models_lv.get_tunnels_by_tor(self.mgr))
+        allocator = TunnelIDAllocator(available, used)
+        self._tunnel_ids[self.mgr] = allocator
+        return allocator
 
     #get an avaliable tunnel id
     def newtunnel(self, src, dst):
-        tunnel_id = self._get_avaliable_tunnel_id()
-        if tunnel_id == -1:
-            return False, tunnel_id
-        return self._create_tunnel(tunnel_id, src, dst), tunnel_id
+        allocator = self._tunnel_allocator()
+        if allocator is None:
+            return False, -1
+        tunnel_id = allocator.allocate()
+        if not self._create_tunnel(tunnel_id, src, dst):
+            #the id may have been taken behind our back, only then the
+            #switch is asked again.
+            allocator.release(tunnel_id)
+            allocator = self._tunnel_allocator(reseed=True)
+            if allocator is None or tunnel_id not in allocator.used:
+                return False, tunnel_id
+            tunnel_id = allocator.allocate()
+            if not self._create_tunnel(tunnel_id, src, dst):
+                allocator.release(tunnel_id)
+                return False, tunnel_id
+        txn = self._txns.get(self.mgr)
+        if txn:
+            txn.tunnel_ids.append(tunnel_id)
+        return True, tunnel_id
 
     def deletetunnel(self, tunnel_id):
-        return self._delete_tunnel(tunnel_id)
+        if not self._delete_tunnel(tunnel_id):
+            return False
+        txn = self._txns.get(self.mgr)
+        if txn:
+            txn.released_ids.append(tunnel_id)
+            return True
+        allocator = self._tunnel_ids.get(self.mgr)
+        if allocator:
+            allocator.release(tunnel_id)
+        return True
 
-    def newvlan2vxlan(self, index, vlan, vxlan):
+    def _vlan2vxlan_rows(self, index, vlan, vxlan):
         vsiname = "vsi" + str(vxlan)
+        return [self._vsi_row(vsiname, MERGE),
+                self._create_service_row(index, vlan, vlan),
+                self._create_port_ac_row(index, vlan, vsiname),
+                self._create_vxlan_row(vxlan, vsiname)]
+
+    def _delete_vlan2vxlan_rows(self, index, vlan, vxlan, only_index=False):
+        vsiname = "vsi" + str(vxlan)
+        rows = [self._delete_port_ac_row(index, vlan),
+                self._delete_service_row(index, vlan)]
+        if not only_index:
+            #unbind the vxlan before its vsi goes away.
+            rows.insert(0, self._delete_vxlan_row(vxlan))
+            rows.append(self._vsi_row(vsiname, REMOVE))
+        return rows
+
+    def newvlan2vxlan(self, index, vlan, vxlan):
         print "newvlan2vxlan: vxlan %s vlan %s index %s tor %s" %(vxlan, vlan, index, self.mgr)
-        self._create_vsi(vsiname)
-        self._create_vxlan(vxlan, vsiname)
-        self._create_service(index, vlan, vlan)
-        self._create_port_ac(index, vlan, vsiname)
-        return True
+        failed = self._edit(self._vlan2vxlan_rows(index, vlan, vxlan),
+                            'create_vlan2vxlan')
+        self._report("newvlan2vxlan", failed)
+        return not failed
 
     def deletevlan2vxlan(self, index, vlan, vxlan, only_index=False):
-        vsiname = "vsi" + str(vxlan)
-        self._delete_port_ac(index, vlan)
-        self._delete_service(index, vlan)
-        if only_index:
-            return True
-        self._delete_vxlan(vxlan)
-        self._delete_vsi(vsiname)
-        #return (self._delete_port_ac(index, vlan)
-        #        and self._delete_service(index, vlan)
-        #        and self._delete_vxlan(vxlan)
-        #        and self._delete_vsi(vsiname))
+        #entries already gone are fine here, xc:operation remove ignores them.
+        failed = self._edit(self._delete_vlan2vxlan_rows(index, vlan, vxlan, only_index),
+                            'delete_vlan2vxlan')
+        self._report("deletevlan2vxlan", failed)
         return True
 
+    def _batch_rows(self, method, args):
+        if method == 'newvlan2vxlan':
+            return MERGE, self._vlan2vxlan_rows(*args)
+        if method == 'deletevlan2vxlan':
+            return REMOVE, self._delete_vlan2vxlan_rows(*args)
+        if method == 'ensureVxlanWithTunnel':
+            vxlans, tunnel_ids = args
+            return MERGE, [self._edit_vxlan_row(vxlan, tunnel_id)
+                           for vxlan in vxlans for tunnel_id in tunnel_ids]
+        return None, None
+
+    def _ordered(self, operation, rows):
+        order = list(_TABLE_ORDER)
+        if operation == REMOVE:
+            order.reverse()
+        return sorted(rows, key=lambda row: order.index((row.module, row.table)))
+
+    def _send_batch(self, operation, calls):
+        rows = [row for _, _, call_rows in calls for row in call_rows]
+        failed = set(self._edit(self._ordered(operation, rows),
+                                'batch_' + operation))
+        if operation == REMOVE:
+            self._report("batch", failed)
+            return []
+        return [(method, args) for method, args, call_rows in calls
+                if failed.intersection(call_rows)]
+
+    def batch(self, calls):
+        """Send consecutive creates, or consecutive removes, of calls in one
+        edit-config each."""
+        failed = []
+        run, run_operation = [], None
+        for method, args in calls:
+            operation, rows = self._batch_rows(method, args)
+            if operation != run_operation and run:
+                failed.extend(self._send_batch(run_operation, run))
+                run = []
+            run_operation = operation
+            if operation is None:
+                if not getattr(self, method)(*args):
+                    failed.append((method, args))
+                continue
+            run.append((method, args, rows))
+        if run:
+            failed.extend(self._send_batch(run_operation, run))
+        return failed
+
     def ensureVxlanWithTunnel(self, vxlans, tunnel_ids):
+        pairs, seen = [], set()
         for vxlan in vxlans:
             for tunnel_id in tunnel_ids:
-                self._edit_vxlan_tunnel(vxlan, tunnel_id)
-        return True
+                if (vxlan, tunnel_id) not in seen:
+                    seen.add((vxlan, tunnel_id))
+                    pairs.append((vxlan, tunnel_id))
+        failed = self._edit_vxlan_tunnels(pairs)
+        for vxlan, tunnel_id in failed:
+            print "ensureVxlanWithTunnel: vxlan %s tunnel %s failed on tor %s" %(vxlan, tunnel_id, self.mgr)
+        return not failed
+
+    def _parse_state(self, entries):
+        """Collect the vsi, vxlan, tunnel and port tables from the entries
+        of a get-config reply as they stream in."""
+        state = {"vsis": set(), "vxlans": {}, "bindings": set(),
+                 "tunnels": {}, "services": {}, "acs": {}}
+        for e in entries:
+            table = e.getparent()
+            if table is None or table.getparent() is None:
+                continue
+            where = (_local(table.getparent().tag), _local(table.tag), _local(e.tag))
+            if where not in _STATE_ROWS:
+                continue
+            fields = dict((_local(c.tag), c.text) for c in e.iter() if c is not e)
+            if where == ('L2VPN', 'VSIs', 'VSI'):
+                state["vsis"].add(fields["VsiName"])
+            elif where == ('L2VPN', 'SRVs', 'SRV'):
+                key = (int(fields["IfIndex"]), int(fields["SrvID"]))
+                state["services"][key] = fields.get("SVlanRange")
+            elif where == ('L2VPN', 'ACs', 'AC'):
+                key = (int(fields["IfIndex"]), int(fields["SrvID"]))
+                state["acs"][key] = fields.get("VsiName")
+            elif where == ('VXLAN', 'VXLANs', 'Vxlan'):
+                state["vxlans"][int(fields["VxlanID"])] = fields.get("VsiName")
+            elif where == ('VXLAN', 'Tunnels', 'Tunnel'):
+                state["bindings"].add((int(fields["VxlanID"]), int(fields["TunnelID"])))
+            elif where == ('TUNNEL', 'Tunnels', 'Tunnel'):
+                state["tunnels"][int(fields["ID"])] = (fields.get("SrcAddr"),
+                                                       fields.get("DstAddr"))
+        return state
+
+    def _get_state(self):
+        entries = set(entry for module, table, entry in _STATE_ROWS)
+        return self._parse_state(self._read(
+                'get_state', 'get_config', entries, source='running',
+                filter=('subtree', self.RETRIEVE_STATE)))
+
+    def _diff_state(self, desired, current):
+        """Return the rows that turn current into desired, and the tunnels
+        whose endpoints differ."""
+        tunnels, vxlans, ports = desired["tunnels"], desired["vxlans"], desired["ports"]
+        vsinames = dict((vxlan, "vsi" + str(vxlan)) for vxlan in vxlans)
+        bindings = set((vxlan, id) for vxlan in vxlans for id in tunnels)
+
+        create, remove, conflicts = [], [], []
+        for id, (src, dst) in tunnels.items():
+            if id not in current["tunnels"]:
+                create.append(self._create_tunnel_row(id, src, dst))
+            elif current["tunnels"][id] != (src, dst):
+                conflicts.append(id)
+        for vxlan, name in vsinames.items():
+            if name not in current["vsis"]:
+                create.append(self._vsi_row(name, MERGE))
+            if current["vxlans"].get(vxlan) != name:
+                create.append(self._create_vxlan_row(vxlan, name))
+        for (index, vlan), vxlan in ports.items():
+            if current["services"].get((index, vlan)) != str(vlan):
+                create.append(self._create_service_row(index, vlan, vlan))
+            if current["acs"].get((index, vlan)) != "vsi" + str(vxlan):
+                create.append(self._create_port_ac_row(index, vlan, "vsi" + str(vxlan)))
+        for vxlan, id in bindings - current["bindings"]:
+            create.append(self._edit_vxlan_row(vxlan, id))
+
+        if CONF.h3c.reconcile_prune:
+            for id in set(current["tunnels"]) - set(tunnels):
+                remove.append(self._delete_tunnel_row(id))
+            for name in current["vsis"] - set(vsinames.values()):
+                remove.append(self._vsi_row(name, REMOVE))
+            for vxlan in set(current["vxlans"]) - set(vsinames):
+                remove.append(self._delete_vxlan_row(vxlan))
+            for index, vlan in set(current["services"]) - set(ports):
+                remove.append(self._delete_service_row(index, vlan))
+            for index, vlan in set(current["acs"]) - set(ports):
+                remove.append(self._delete_port_ac_row(index, vlan))
+            for vxlan, id in current["bindings"] - bindings:
+                remove.append(_Row('VXLAN', 'Tunnels', 'Tunnel', (vxlan, id),
+                                   self._render('delete_vxlan_tunnel_xml', vxlanid=vxlan, tunnelid=id)))
+        return create, remove, conflicts
+
+    def reconcile(self, desired):
+        """Pull the config of the switch and push what differs from desired.
+
+        desired holds the tunnels as {id: (src, dst)}, the vxlans of the
+        tor and its ports as {(ifindex, vlan): vxlan}.
+        """
+        try:
+            current = self._get_state()
+        except Exception as e:
+            print "reconcile: reading tor %s failed: %s" %(self.mgr, e)
+            return None
+        create, remove, conflicts = self._diff_state(desired, current)
+        size = max(CONF.h3c.tunnel_bind_chunk_size, 1)
+        failed = []
+        for operation, rows in ((REMOVE, remove), (MERGE, create)):
+            rows = self._ordered(operation, rows)
+            chunks = [rows[start:start + size] for start in range(0, len(rows), size)]
+            failed.extend(self._edit_chunks(chunks, 'reconcile_' + operation))
+        name = lambda row: "%s%s" %(row.tag, row.keys)
+        return {"created": [name(row) for row in create],
+                "removed": [name(row) for row in remove],
+                "failed": [name(row) for row in failed],
+                "conflicts": ["Tunnel%s" %((id,),) for id in conflicts]}
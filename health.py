@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import time
+
+import eventlet
+from eventlet import event
+from oslo.config import cfg
+
+from torconf import utils
+
+health_opts = [
+    cfg.IntOpt('failure_threshold', default=3,
+               help="Consecutive failures after which a switch is marked down"),
+    cfg.IntOpt('open_timeout', default=30,
+               help="Seconds a switch stays marked down before it is tried again"),
+    cfg.IntOpt('probe_interval', default=10,
+               help="Seconds between two background probes of the switches "
+                    "marked down, 0 disables the probes"),
+    cfg.StrOpt('down_policy', default='fail',
+               help="What happens to requests for a switch marked down: "
+                    "'fail' fails them at once, 'queue' holds them on the "
+                    "queue of the switch until it is back"),
+    cfg.IntOpt('queue_timeout', default=300,
+               help="Seconds a request is held with down_policy 'queue'"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(health_opts, group='health')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class _SwitchHealth(object):
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        #sent when the switch comes back, waited on by queued requests.
+        self.recovered = None
+
+
+class HealthTracker(object):
+    """A circuit breaker per switch.
+
+    failure_threshold consecutive failures open the breaker and requests
+    are refused without touching the switch. After open_timeout one
+    request, or a background probe, is let through half-open: success
+    closes the breaker, failure opens it again.
+    """
+
+    def __init__(self):
+        self._switches = {}
+        self._probes = None
+
+    def _get(self, mgr):
+        switch = self._switches.get(mgr)
+        if switch is None:
+            switch = self._switches[mgr] = _SwitchHealth()
+        return switch
+
+    def allow(self, mgr):
+        """Whether a request may go to mgr, a request let through on an
+        open breaker is its trial and has to report back."""
+        switch = self._get(mgr)
+        if switch.state == CLOSED:
+            return True
+        if (switch.state == OPEN and
+                time.time() - switch.opened_at >= CONF.health.open_timeout):
+            switch.state = HALF_OPEN
+            return True
+        return False
+
+    def available(self, mgr):
+        """Whether mgr may be connected to, without claiming a trial."""
+        switch = self._switches.get(mgr)
+        return switch is None or switch.state != OPEN
+
+    def success(self, mgr):
+        switch = self._get(mgr)
+        recovered = switch.recovered
+        if switch.state != CLOSED:
+            print "tor %s is back up" %(mgr)
+        switch.state = CLOSED
+        switch.failures = 0
+        switch.recovered = None
+        if recovered:
+            recovered.send(True)
+
+    def failure(self, mgr, error=None):
+        switch = self._get(mgr)
+        switch.failures += 1
+        switch.last_error = str(error) if error else None
+        if (switch.state == HALF_OPEN or
+                switch.failures >= CONF.health.failure_threshold):
+            if switch.state == CLOSED:
+                print "tor %s marked down after %d failures" %(mgr, switch.failures)
+            switch.state = OPEN
+            switch.opened_at = time.time()
+            if switch.recovered is None:
+                switch.recovered = event.Event()
+
+    def wait(self, mgr, timeout):
+        """Wait up to timeout seconds for mgr to come back."""
+        switch = self._get(mgr)
+        if switch.recovered is not None:
+            with eventlet.Timeout(timeout, False):
+                switch.recovered.wait()
+        return switch.state == CLOSED
+
+    def forget(self, mgr):
+        switch = self._switches.pop(mgr, None)
+        if switch and switch.recovered:
+            switch.recovered.send(False)
+
+    def status(self):
+        return dict((mgr, {"state": s.state,
+                           "failures": s.failures,
+                           "opened_at": s.opened_at,
+                           "last_error": s.last_error})
+                    for mgr, s in self._switches.items())
+
+    def start_probes(self, probe):
+        """Call probe(mgr) in the background for switches due a retry,
+        probe returns whether the switch answered."""
+        interval = CONF.health.probe_interval
+        if interval <= 0 or self._probes:
+            return
+        def _probe_all():
+            for mgr, switch in self._switches.items():
+                if switch.state == OPEN and self.allow(mgr):
+                    eventlet.spawn_n(self._probe, probe, mgr)
+        self._probes = utils.FixedIntervalLoopingCall(_probe_all)
+        self._probes.start(interval=interval, initial_delay=interval)
+
+    def _probe(self, probe, mgr):
+        try:
+            ok = probe(mgr)
+        except Exception as e:
+            ok, error = False, e
+        else:
+            error = None if ok else "probe failed"
+        if ok:
+            self.success(mgr)
+        else:
+            self.failure(mgr, error)
+
+
+TRACKER = HealthTracker()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import time
+import bisect
+import contextlib
+
+#upper bounds of the histogram buckets, the last bucket takes the rest.
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+HISTOGRAM_BUCKETS = {
+    'netconf_rpc_seconds': LATENCY_BUCKETS,
+    'netconf_connect_seconds': LATENCY_BUCKETS,
+    'netconf_reply_bytes': SIZE_BUCKETS,
+}
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        cumulative, buckets = 0, []
+        for le, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            buckets.append([le, cumulative])
+        return {"count": self.count, "sum": self.sum,
+                "min": self.min, "max": self.max, "buckets": buckets}
+
+
+class Registry(object):
+    """Histograms and counters labeled by switch and operation."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, switch, operation, value):
+        key = (name, switch, operation)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(
+                    HISTOGRAM_BUCKETS.get(name, LATENCY_BUCKETS))
+        histogram.observe(value)
+
+    def increment(self, name, switch, operation, value=1):
+        key = (name, switch, operation)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name, switch, operation, errors=None):
+        """Observe the seconds the block takes, count it in errors when
+        it raises."""
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            if errors:
+                self.increment(errors, switch, operation)
+            raise
+        finally:
+            self.observe(name, switch, operation, time.time() - start)
+
+    def snapshot(self, switch=None):
+        histograms, counters = {}, {}
+        for (name, sw, operation), histogram in sorted(self._histograms.items()):
+            if switch is None or sw == switch:
+                h = histogram.to_dict()
+                h.update(switch=sw, operation=operation)
+                histograms.setdefault(name, []).append(h)
+        for (name, sw, operation), value in sorted(self._counters.items()):
+            if switch is None or sw == switch:
+                counters.setdefault(name, []).append(
+                        {"switch": sw, "operation": operation, "value": value})
+        return {"histograms": histograms, "counters": counters}
+
+    def reset(self):
+        self._histograms.clear()
+        self._counters.clear()
+
+
+REGISTRY = Registry()
+
+observe = REGISTRY.observe
+increment = REGISTRY.increment
+timer = REGISTRY.timer
+snapshot = REGISTRY.snapshot
+reset = REGISTRY.reset
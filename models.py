@@ -4,6 +4,7 @@ import sqlalchemy as sa
 
 from torconf import model_base
 from torconf import db
+from torconf import utils
 
 class SapiProvisionedNets(model_base.BASE):
     __tablename__ = "sapi_provisioned_nets"
@@ -23,6 +24,7 @@ class SapiProvisionedNets(model_base.BASE):
                 'admin_state_up': self.admin_state_up,
                 'shared': self.shared}
 
+@utils.blocking
 def update_net(network_id, net):
     session = db.get_session()
     with session.begin():
@@ -30,6 +32,7 @@ def update_net(network_id, net):
                 filter_by(network_id=network_id).one())
         n.update(net)
 
+@utils.blocking
 def save_net(net):
     session = db.get_session()
     with session.begin():
@@ -41,12 +44,14 @@ def save_net(net):
                 shared=net["shared"])
         session.add(net)
 
+@utils.blocking
 def delete_net(network_id):
     session = db.get_session()
     with session.begin():
         (session.query(SapiProvisionedNets).
                 filter_by(network_id=network_id).delete())
 
+@utils.blocking
 def get_net(network_id):
     session = db.get_session()
     with session.begin():
@@ -54,11 +59,13 @@ def get_net(network_id):
                 filter_by(network_id=network_id).one())
         return net.sapi_net_representation()
 
+@utils.blocking
 def clear_nets():
     session = db.get_session()
     with session.begin():
         (session.query(SapiProvisionedNets).delete())
 
+@utils.blocking
 def get_nets():
     session = db.get_session()
     with session.begin():
@@ -77,6 +84,7 @@ class SapiTor(model_base.BASE):
                 "tunnel_src_ip": self.tunnel_src_ip,
                 "type": self.type}
 
+@utils.blocking
 def save_tor(tor):
     session = db.get_session()
     with session.begin():
@@ -85,12 +93,14 @@ def save_tor(tor):
                 type=tor["type"])
         session.add(tor)
 
+@utils.blocking
 def delete_tor(tor_ip):
     session = db.get_session()
     with session.begin():
         (session.query(SapiTor).
                 filter_by(tor_ip=tor_ip).delete())
 
+@utils.blocking
 def get_tor(tor_ip):
     session = db.get_session()
     with session.begin():
@@ -98,6 +108,7 @@ def get_tor(tor_ip):
                 filter_by(tor_ip=tor_ip).one())
         return tor.sapi_tor_representation()
 
+@utils.blocking
 def get_tors():
     session = db.get_session()
     with session.begin():
@@ -132,6 +143,7 @@ class SapiProvisionedPorts(model_base.BASE):
                 'ip_address': self.ip_address,
                 'mac_address': self.mac_address}
 
+@utils.blocking
 def update_port(port_id, port):
     session = db.get_session()
     with session.begin():
@@ -139,6 +151,7 @@ def update_port(port_id, port):
                 filter_by(port_id=port_id).one())
         p.update(port)
 
+@utils.blocking
 def save_port(port):
     session = db.get_session()
     with session.begin():
@@ -156,12 +169,14 @@ def save_port(port):
                 mac_address = port['mac_address'])
         session.add(port)
 
+@utils.blocking
 def delete_port(port_id):
     session = db.get_session()
     with session.begin():
         (session.query(SapiProvisionedPorts).
                 filter_by(port_id=port_id).delete())
 
+@utils.blocking
 def get_port(port_id):
     session = db.get_session()
     with session.begin():
@@ -169,11 +184,13 @@ def get_port(port_id):
                 filter_by(port_id=port_id).one())
         return port.sapi_port_representation()
 
+@utils.blocking
 def clear_ports():
     session = db.get_session()
     with session.begin():
         (session.query(SapiProvisionedPorts).delete())
 
+@utils.blocking
 def get_ports():
     session = db.get_session()
     with session.begin():
@@ -196,6 +213,7 @@ class SapiProvisionedSubnets(model_base.BASE):
                 'shared': self.shared,
                 'enable_dhcp': self.enable_dhcp}
 
+@utils.blocking
 def save_subnet(subnet):
     session = db.get_session()
     with session.begin():
@@ -207,6 +225,7 @@ def save_subnet(subnet):
                 shared = subnet['shared'])
         session.add(subnet)
 
+@utils.blocking
 def update_subnet(subnet_id, subnet):
     session = db.get_session()
     with session.begin():
@@ -214,12 +233,14 @@ def update_subnet(subnet_id, subnet):
                 filter_by(subnet_id=subnet_id).one())
         s.update(subnet)
 
+@utils.blocking
 def delete_subnet(subnet_id):
     session = db.get_session()
     with session.begin():
         (session.query(SapiProvisionedSubnets).
                 filter_by(subnet_id=subnet_id).delete())
 
+@utils.blocking
 def get_subnet(subnet_id):
     session = db.get_session()
     with session.begin():
@@ -227,11 +248,13 @@ def get_subnet(subnet_id):
                 filter_by(subnet_id=subnet_id).one())
         return subnet.sapi_subnet_representation()
 
+@utils.blocking
 def clear_subnets():
     session = db.get_session()
     with session.begin():
         (session.query(SapiProvisionedSubnets).delete())
 
+@utils.blocking
 def get_subnets():
     session = db.get_session()
     with session.begin():
@@ -4,6 +4,7 @@ import sqlalchemy as sa
 
 from torconf import model_base
 from torconf import db
+from torconf import utils
 
 class SapiVlanAllocations(model_base.BASE):
     __tablename__ = "sapi_vlan_allocations"
@@ -22,6 +23,7 @@ class SapiVlanAllocations(model_base.BASE):
                 "allocated": self.allocated,
                 "shared":self.shared}
 
+@utils.blocking
 def save_vlan_allocations(va):
     session = db.get_session()
     with session.begin():
@@ -32,12 +34,14 @@ def save_vlan_allocations(va):
                 shared=va["shared"])
         session.add(_va)
 
+@utils.blocking
 def delete_vlan_allocations(tor_ip, network_id):
     session = db.get_session()
     with session.begin():
         (session.query(SapiVlanAllocations).
                 filter_by(tor_ip=tor_ip, network_id=network_id).delete())
 
+@utils.blocking
 def get_vlan_allocations():
     session = db.get_session()
     with session.begin():
@@ -57,6 +61,7 @@ class SapiTorTunnel(model_base.BASE):
                 "dst_addr":self.dst_addr,
                 "tunnel_id":self.tunnel_id}
 
+@utils.blocking
 def save_tunnel(tt):
     session = db.get_session()
     with session.begin():
@@ -65,12 +70,14 @@ def save_tunnel(tt):
                 dst_addr=tt["dst_addr"])
         session.add(_tt)
 
+@utils.blocking
 def delete_tunnel(tor_ip, id):
     session = db.get_session()
     with session.begin():
         (session.query(SapiTorTunnel).
                 filter_by(tor_ip=tor_ip, tunnel_id=id).delete())
 
+@utils.blocking
 def get_tunnel_with_tor(tor_ip, dst_addr):
     session = db.get_session()
     with session.begin():
@@ -81,6 +88,15 @@ def get_tunnel_with_tor(tor_ip, dst_addr):
         return [tt.sapi_tor_tunnels_rep() for tt in _tts],\
                 [tt1.sapi_tor_tunnels_rep() for tt1 in _tts1]
 
+@utils.blocking
+def get_tunnels_by_tor(tor_ip):
+    session = db.get_session()
+    with session.begin():
+        tts = (session.query(SapiTorTunnel).
+                filter_by(tor_ip=tor_ip))
+        return [tt.sapi_tor_tunnels_rep() for tt in tts]
+
+@utils.blocking
 def get_tunnnels():
     session = db.get_session()
     with session.begin():
@@ -103,6 +119,7 @@ class SapiPortVlanMapping(model_base.BASE):
                 'vlan_id': self.vlan_id,
                 'index':self.index}
 
+@utils.blocking
 def save_port_vlan_mapping(pvm):
     session = db.get_session()
     with session.begin():
@@ -113,12 +130,14 @@ def save_port_vlan_mapping(pvm):
                 index=pvm["index"])
         session.add(_pvm)
 
+@utils.blocking
 def delete_port_vlan_mapping(port_id):
     session = db.get_session()
     with session.begin():
         (session.query(SapiPortVlanMapping).
                 filter_by(port_id=port_id).delete())
 
+@utils.blocking
 def get_port_vlan_mapping(port_id):
     session = db.get_session()
     with session.begin():
@@ -126,18 +145,29 @@ def get_port_vlan_mapping(port_id):
                 filter_by(port_id=port_id).one())
         return pvm.sapi_port_vlan_representation()
 
+@utils.blocking
+def get_port_vlan_mappings_by_tor(tor_ip):
+    session = db.get_session()
+    with session.begin():
+        pvms = (session.query(SapiPortVlanMapping).
+                filter_by(tor_ip=tor_ip))
+        return [pvm.sapi_port_vlan_representation() for pvm in pvms]
+
+@utils.blocking
 def get_pvm_count_by_net(tor_ip, network_id):
     session = db.get_session()
     with session.begin():
         return (session.query(SapiPortVlanMapping).
                 filter_by(tor_ip=tor_ip, network_id=network_id).count())
 
+@utils.blocking
 def get_pvm_count_by_tor_index(tor_ip, index):
     session = db.get_session()
     with session.begin():
         return (session.query(SapiPortVlanMapping).
                 filter_by(tor_ip=tor_ip, index=index).count())
 
+@utils.blocking
 def is_exists_port_vlan_mapping(tor_ip, vlan_id, index):
     session = db.get_session()
     with session.begin():
@@ -156,6 +186,7 @@ class SapiTorVsis(model_base.BASE):
         return {"tor_ip":self.tor_ip,
                 "vxlan":self.vxlan}
 
+@utils.blocking
 def save_vsi(vsi):
     session = db.get_session()
     with session.begin():
@@ -163,15 +194,24 @@ def save_vsi(vsi):
                 vxlan=vsi["vxlan"])
         session.add(_vsi)
 
+@utils.blocking
 def delete_vsi(tor_ip, vxlan):
     session = db.get_session()
     with session.begin():
         (session.query(SapiTorVsis).
                 filter_by(tor_ip=tor_ip, vxlan=vxlan).delete())
 
+@utils.blocking
 def get_vsis_by_tor(tor_ip):
     session = db.get_session()
     with session.begin():
         _vsis = (session.query(SapiTorVsis).
                 filter_by(tor_ip=tor_ip))
         return [v.sapi_vsi_rep() for v in _vsis]
+
+@utils.blocking
+def get_vsis():
+    session = db.get_session()
+    with session.begin():
+        _vsis = (session.query(SapiTorVsis))
+        return [v.sapi_vsi_rep() for v in _vsis]
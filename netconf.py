@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import time
+import contextlib
+
+from eventlet import semaphore
+from ncclient import manager
+from oslo.config import cfg
+
+from torconf import health
+from torconf import metrics
+from torconf import utils
+
+netconf_opts = [
+    cfg.IntOpt('port', default=830,
+               help="NETCONF over SSH port of the switches"),
+    cfg.IntOpt('connect_timeout', default=10,
+               help="Seconds to wait for a NETCONF session to be set up"),
+    cfg.IntOpt('max_sessions_per_switch', default=1,
+               help="Maximum number of concurrent sessions to one switch"),
+    cfg.IntOpt('session_max_age', default=0,
+               help="Seconds after which a session is re-established, "
+                    "0 keeps sessions until they break"),
+    cfg.IntOpt('keepalive_interval', default=30,
+               help="Idle seconds after which a session is probed, "
+                    "0 disables the probes"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(netconf_opts, group='netconf')
+
+
+class _Session(object):
+    """A NETCONF session and its bookkeeping."""
+
+    def __init__(self, mgr, conn):
+        self.mgr = mgr
+        self.conn = conn
+        self.created = time.time()
+        self.last_used = self.created
+
+
+class _SwitchSessions(object):
+    """Idle sessions and connection slots of one switch."""
+
+    def __init__(self, user, passwd, limit):
+        self.user = user
+        self.passwd = passwd
+        self.idle = []
+        self.slots = semaphore.Semaphore(limit)
+
+
+class SessionPool(object):
+    """Persistent NETCONF sessions, kept per switch.
+
+    Sessions are checked out for the duration of one RPC and returned
+    afterwards, every switch ages its own sessions and at most
+    max_sessions_per_switch of them are open at a time. A session idle
+    for longer than keepalive_interval is probed before reuse, broken
+    sessions are dropped and re-established on the next checkout.
+    """
+
+    def __init__(self, probe=None):
+        self._switches = {}
+        self._probe = probe
+        self._keepalive = None
+        #sessions to close when they are checked in.
+        self._dropped = set()
+
+    def register(self, mgr, user, passwd):
+        switch = self._switches.get(mgr)
+        if switch is None:
+            self._switches[mgr] = _SwitchSessions(
+                    user, passwd, CONF.netconf.max_sessions_per_switch)
+        elif (switch.user, switch.passwd) != (user, passwd):
+            switch.user, switch.passwd = user, passwd
+            self._close_idle(switch)
+
+    def warm(self, mgr):
+        """Make sure a usable session to mgr exists."""
+        try:
+            with self.session(mgr):
+                pass
+        except Exception as e:
+            print "netconf session to %s failed: %s" %(mgr, e)
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def session(self, mgr):
+        if not health.TRACKER.available(mgr):
+            raise IOError("tor %s is marked down" %(mgr))
+        switch = self._switches[mgr]
+        with switch.slots:
+            sess = self._checkout(mgr, switch)
+            try:
+                yield sess.conn
+            finally:
+                self._checkin(switch, sess)
+
+    def drop(self, conn):
+        """Close the checked out session conn once it is checked in,
+        instead of keeping it for the next checkout."""
+        self._dropped.add(conn)
+
+    def close(self, mgr=None):
+        """Close the idle sessions of mgr, or of all switches. A switch
+        named is forgotten too, its sessions still checked out are
+        closed as they come back."""
+        if mgr is not None:
+            switch = self._switches.pop(mgr, None)
+            if switch:
+                self._close_idle(switch)
+            return
+        for switch in self._switches.values():
+            self._close_idle(switch)
+
+    def keepalive(self):
+        """Probe idle sessions so the switches do not time them out."""
+        for switch in self._switches.values():
+            if not switch.slots.acquire(blocking=False):
+                continue
+            try:
+                now = time.time()
+                for sess in list(switch.idle):
+                    if not self._usable(sess, now):
+                        switch.idle.remove(sess)
+                        self._close(sess)
+            finally:
+                switch.slots.release()
+
+    def start_keepalive(self):
+        interval = CONF.netconf.keepalive_interval
+        if interval <= 0 or self._keepalive:
+            return
+        self._keepalive = utils.FixedIntervalLoopingCall(self.keepalive)
+        self._keepalive.start(interval=interval, initial_delay=interval)
+
+    def _checkout(self, mgr, switch):
+        now = time.time()
+        while switch.idle:
+            sess = switch.idle.pop()
+            if self._usable(sess, now):
+                return sess
+            self._close(sess)
+        return self._connect(mgr, switch)
+
+    def _checkin(self, switch, sess):
+        if sess.conn in self._dropped:
+            self._dropped.discard(sess.conn)
+            self._close(sess)
+        elif self._switches.get(sess.mgr) is not switch:
+            self._close(sess)
+        elif sess.conn.connected:
+            sess.last_used = time.time()
+            switch.idle.append(sess)
+        else:
+            self._close(sess)
+
+    def _usable(self, sess, now):
+        max_age = CONF.netconf.session_max_age
+        if max_age > 0 and now - sess.created > max_age:
+            return False
+        if not sess.conn.connected:
+            return False
+        interval = CONF.netconf.keepalive_interval
+        if self._probe and interval > 0 and now - sess.last_used > interval:
+            try:
+                self._probe(sess.mgr, sess.conn)
+            except Exception:
+                return False
+            sess.last_used = time.time()
+        return True
+
+    def _connect(self, mgr, switch):
+        with metrics.timer('netconf_connect_seconds', mgr, 'connect',
+                           errors='netconf_errors'):
+            conn = utils.offload(manager.connect_ssh,
+                                 host=mgr,
+                                 port=CONF.netconf.port,
+                                 username=switch.user,
+                                 password=switch.passwd,
+                                 timeout=CONF.netconf.connect_timeout,
+                                 hostkey_verify=False,
+                                 look_for_keys=False)
+        return _Session(mgr, conn)
+
+    def _close_idle(self, switch):
+        while switch.idle:
+            self._close(switch.idle.pop())
+
+    def _close(self, sess):
+        try:
+            if sess.conn.connected:
+                utils.offload(sess.conn.close_session)
+        except Exception:
+            pass
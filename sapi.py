@@ -2,19 +2,40 @@
 # encoding: utf-8
 import sys
 import traceback
+import contextlib
+import eventlet
+from eventlet import event
+from eventlet import queue
 from sqlalchemy.orm import exc
 
 from oslo.config import cfg
 from oslo.db import exception
 
+from torconf import base
+from torconf import health
+from torconf import metrics
 from torconf import models
 from torconf import models_lv
 from torconf import rpc
+from torconf import state
+from torconf import utils
 from torconf import topology
+from torconf import writebehind
 from torconf import exceptions
 
 VXLAN = "vxlan"
 
+sapi_opts = [
+    cfg.IntOpt('tor_config_concurrency', default=16,
+               help="Number of switches configured at the same time"),
+    cfg.IntOpt('reconcile_interval', default=0,
+               help="Seconds between two switches reconciled in the "
+                    "background, 0 disables background reconciliation"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(sapi_opts)
+
 def import_class_ins(import_str, *args, **kwargs):
     mod_str, _sep, class_str = import_str.rpartition('.')
     __import__(mod_str)
@@ -35,25 +56,202 @@ class DriverManager(object):
     def __getitem__(self, type):
         return self._drivers[type]
 
+class SwitchDispatcher(object):
+    """Serializes the work of every tor on a FIFO queue of its own.
+
+    Each tor gets a worker which runs its jobs one after another, so
+    requests against one switch keep their order while different switches
+    are configured in parallel.
+    """
+
+    def __init__(self):
+        self._queues = {}
+
+    def submit(self, tor_ip, func, *args, **kwargs):
+        """Queue func for tor_ip, return an event carrying its result."""
+        jobs = self._queues.get(tor_ip)
+        if jobs is None:
+            jobs = self._queues[tor_ip] = queue.LightQueue()
+            eventlet.spawn_n(self._worker, jobs)
+        done = event.Event()
+        jobs.put((func, args, kwargs, done))
+        return done
+
+    def call(self, tor_ip, func, *args, **kwargs):
+        return self.submit(tor_ip, func, *args, **kwargs).wait()
+
+    def remove(self, tor_ip):
+        """Let the worker of tor_ip finish the jobs queued so far and exit."""
+        jobs = self._queues.pop(tor_ip, None)
+        if jobs is not None:
+            jobs.put(None)
+
+    def _worker(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            func, args, kwargs, done = job
+            try:
+                done.send(func(*args, **kwargs))
+            except Exception:
+                done.send_exception(*sys.exc_info())
+
 class Sapi():
     def __init__(self):
+        self.dispatcher = SwitchDispatcher()
         self._setup_rpc()
         self._load_switch_drivers()
+        self._setup_health()
         self._setup_topology()
+        self._setup_state()
+        self._setup_reconcile()
 
     def _load_switch_drivers(self):
         self.switch_drivers = DriverManager()
         for type, class_str in cfg.CONF.switchs.items():
             try:
-                self.switch_drivers[type] = import_class_ins(class_str)
+                driver = import_class_ins(class_str)
+                if CONF.write_behind_window > 0:
+                    driver = writebehind.WriteBehindDriver(
+                            driver, self.dispatcher, CONF.write_behind_window,
+                            self._write_behind_failed)
+                self.switch_drivers[type] = driver
             except:
                 print "Load _driver %s error" %(class_str)
 
+    def _write_behind_failed(self, mgr):
+        """Buffered edits of mgr did not reach it: drop what is known to be
+        applied there and reconcile it from the database."""
+        self.applied.forget(mgr)
+        def _reconcile():
+            try:
+                print "reconcile tor %s: %s" %(mgr, self.reconcile_tor(mgr))
+            except Exception as e:
+                print "reconcile tor %s failed: %s" %(mgr, e)
+        eventlet.spawn_n(_reconcile)
+
     def _setup_rpc(self):
         self.rpc = rpc.RpcClient.create('q-plugin')
 
     def _setup_topology(self):
-        self.tors = topology.TopofRacks([tor for tor in models.get_tors()])
+        self.tors = topology.TopofRacks([tor for tor in models.get_tors()],
+                                        self._read_lldp)
+        self.tors.start_refresh()
+
+    def _read_lldp(self, tor_ip):
+        """LLDP data of tor_ip read by its switch driver, None to walk it
+        over SNMP instead. The read goes through the queue of the tor and
+        is skipped while its health holds it off, as a config is."""
+        if not self.health.allow(tor_ip):
+            return None
+        def _job():
+            driver = self.switch_drivers[models.get_tor(tor_ip)["type"]]
+            if not driver.initialize(tor_ip, "sinanp", "sinanp"):
+                self.health.failure(tor_ip, "initialize failed")
+                return None
+            self.health.success(tor_ip)
+            return driver.lldp()
+        try:
+            return self.dispatcher.call(tor_ip, _job)
+        except Exception as e:
+            print "reading lldp of tor %s failed: %s" %(tor_ip, e)
+            return None
+
+    def _setup_state(self):
+        self.applied = state.AppliedState()
+        self.applied.load()
+
+    def _setup_reconcile(self):
+        """Reconcile one tor after another in the background, spreading the
+        load of the switches over time."""
+        self._reconcile_next = 0
+        if CONF.reconcile_interval <= 0:
+            return
+        self._reconcile_loop = utils.FixedIntervalLoopingCall(self._reconcile_one)
+        self._reconcile_loop.start(interval=CONF.reconcile_interval,
+                                   initial_delay=CONF.reconcile_interval)
+
+    def _setup_health(self):
+        self.health = health.TRACKER
+        self.health.start_probes(self._probe_tor)
+
+    def _probe_tor(self, mgr):
+        tor = models.get_tor(mgr)
+        return self.switch_drivers[tor["type"]].initialize(mgr, "sinanp", "sinanp")
+
+    def _check_health(self, mgr):
+        """Fail at once for a tor marked down, or hold the request until
+        it is back when down_policy is 'queue'."""
+        if self.health.allow(mgr):
+            return
+        if (CONF.health.down_policy == 'queue' and
+                self.health.wait(mgr, CONF.health.queue_timeout) and
+                self.health.allow(mgr)):
+            return
+        raise exceptions.SapiTorConfigError("tor %s is down" %(mgr))
+
+    def _reconcile_one(self):
+        #an exception would stop the looping call for good.
+        tor_ip = None
+        try:
+            tors = sorted(models.get_tors())
+            if not tors:
+                return
+            tor_ip = tors[self._reconcile_next % len(tors)]
+            self._reconcile_next += 1
+            print "reconcile tor %s: %s" %(tor_ip, self.reconcile_tor(tor_ip))
+        except Exception as e:
+            print "reconcile tor %s failed: %s" %(tor_ip, e)
+
+    @contextlib.contextmanager
+    def _configure(self, type, mgr):
+        """Initialize the driver of a tor and apply the edits made inside
+        the block as one transaction."""
+        driver = self.switch_drivers[type]
+        self._check_health(mgr)
+        if not driver.initialize(mgr, "sinanp", "sinanp"):
+            self.health.failure(mgr, "initialize failed")
+            raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+        self.health.success(mgr)
+        try:
+            with driver.transaction():
+                yield driver
+        except base.ConfigFailError:
+            raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+
+    def _run_on_tor(self, type, mgr, func, applied=None):
+        """Run func(driver) on the queue of the tor and wait for it, the
+        edits of func are applied as one transaction.
+
+        applied(result) records the edits in the applied cache once the
+        transaction is through, still on the queue: with write behind a
+        flush of those edits comes after it, and a flush failing then
+        clears the cache again.
+        """
+        def _job():
+            with self._configure(type, mgr) as driver:
+                result = func(driver)
+            if applied:
+                applied(result)
+            return result
+        return self.dispatcher.call(mgr, _job)
+
+    def _fan_out(self, func, items):
+        """Run func on every item concurrently, return the failed items
+        along with their errors."""
+        pool = eventlet.GreenPool(max(CONF.tor_config_concurrency, 1))
+        def _run(item):
+            try:
+                func(item)
+            except Exception as e:
+                return item, e
+            return item, None
+        return [(item, e) for item, e in pool.imap(_run, items) if e]
+
+    def _check_fan_out(self, failed):
+        if failed:
+            raise exceptions.SapiTorConfigError("; ".join(str(e) for _, e in failed))
 
     def _get_net_from_body(self, body):
         network = body["network"]
@@ -219,13 +417,21 @@ class Sapi():
 
             if not models_lv.is_exists_port_vlan_mapping(tor_ip, vlan, index):
                 tor = models.get_tor(tor_ip)
-                tunnels = [t["tunnel_id"] for t in models_lv.get_tunnnels()]
-                if not self.switch_drivers[tor["type"]].initialize(tor_ip, "sinanp", "sinanp"):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
-                if not self.switch_drivers[tor["type"]].newvlan2vxlan(index, vlan, net["segmentation_id"]):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
-                if not self.switch_drivers[tor["type"]].ensureVxlanWithTunnel([net["segmentation_id"]], tunnels):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
+                vxlan = net["segmentation_id"]
+                tunnel_ids = [t["tunnel_id"] for t in models_lv.get_tunnels_by_tor(tor_ip)]
+                def _attach(driver):
+                    #bindings pushed before do not have to be sent again,
+                    #as the jobs queued ahead of this one left them.
+                    tunnels = self.applied.unbound(tor_ip, vxlan, tunnel_ids)
+                    if not driver.newvlan2vxlan(index, vlan, vxlan):
+                        raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
+                    if tunnels and not driver.ensureVxlanWithTunnel([vxlan], tunnels):
+                        raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
+                    return tunnels
+                def _applied(tunnels):
+                    self.applied.add_vsi(tor_ip, vxlan)
+                    self.applied.add_bindings(tor_ip, [vxlan], tunnels)
+                self._run_on_tor(tor["type"], tor_ip, _attach, _applied)
             if new:
                 models_lv.save_vlan_allocations({"network_id":network_id,
                                                  "tor_ip":tor_ip,
@@ -263,99 +469,214 @@ class Sapi():
                 models_lv.delete_vlan_allocations(tor_ip, network_id)
 
             if icount <= 1:
-                if not self.switch_drivers[type].initialize(tor_ip, "sinanp", "sinanp"):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
-                if not self.switch_drivers[type].deletevlan2vxlan(
-                        pvm["index"], vlan,
-                        net["segmentation_id"],
-                        only_index=only_index):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
+                def _detach(driver):
+                    if not driver.deletevlan2vxlan(
+                            pvm["index"], vlan,
+                            net["segmentation_id"],
+                            only_index=only_index):
+                        raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
+                def _applied(result):
+                    if not only_index:
+                        self.applied.remove_vsi(tor_ip, net["segmentation_id"])
+                self._run_on_tor(type, tor_ip, _detach, _applied)
 
             models_lv.delete_port_vlan_mapping(port_id)
         except exc.NoResultFound:
             raise exceptions.SapiNotFound(message=("port %s could not be found" %(port_id)))
 
+    def _undo_tunnels(self, driver, mgr, tunnel_ids):
+        """Delete the tunnels a failed job made: they are not saved, and
+        without a candidate to roll back they are on the switch already."""
+        for id in tunnel_ids:
+            try:
+                if driver.deletetunnel(id):
+                    continue
+            except Exception as e:
+                print "deleting tunnel %s on tor %s failed: %s" %(id, mgr, e)
+            print "tunnel %s is left on tor %s" %(id, mgr)
+
+    def _delete_tunnels(self, type, mgr, tunnel_ids):
+        def _forget(ids):
+            self.applied.remove_tunnels(mgr, ids)
+            for id in ids:
+                models_lv.delete_tunnel(mgr, id)
+        def _delete(driver):
+            #without a transaction a deleted id is free again at once,
+            #its row must not outlive it when a later delete fails.
+            held = driver.in_transaction()
+            for id in tunnel_ids:
+                if not driver.deletetunnel(id):
+                    raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+                if not held:
+                    _forget([id])
+            return held
+        def _applied(held):
+            if held:
+                _forget(tunnel_ids)
+        self._run_on_tor(type, mgr, _delete, _applied)
+
     def delete_tor(self, request, id, body=None, **kwargs):
         try:
             tor = models.get_tor(id)
             src, mgr, type = tor["tunnel_src_ip"], tor["tor_ip"], tor["type"]
 
             t1, t2 = models_lv.get_tunnel_with_tor(mgr, src)
-            for tunnel in t1:
-                id = tunnel["tunnel_id"]
-                if not self.switch_drivers[type].initialize(mgr, "sinanp", "sinanp"):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
-                if not self.switch_drivers[type].deletetunnel(id):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
-                models_lv.delete_tunnel(mgr, id)
+            if t1:
+                self._delete_tunnels(type, mgr, [t["tunnel_id"] for t in t1])
             models.delete_tor(mgr)
-
+            self.applied.forget(mgr)
+            self.health.forget(mgr)
+            self.switch_drivers[type].forget(mgr)
+            self.dispatcher.remove(mgr)
+
+            #tunnels of the other tors towards this one, the tors are
+            #configured concurrently, one transaction each.
+            remotes = {}
             for tunnel in t2:
-                mgr, id = tunnel["tor_ip"], tunnel["tunnel_id"]
+                remotes.setdefault(tunnel["tor_ip"], []).append(tunnel["tunnel_id"])
+            def _delete_remote(mgr):
                 type = models.get_tor(mgr)["type"]
-                if not self.switch_drivers[type].initialize(mgr, "sinanp", "sinanp"):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
-                if not self.switch_drivers[type].deletetunnel(id):
-                    raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
-                models_lv.delete_tunnel(mgr, id)
+                self._delete_tunnels(type, mgr, remotes[mgr])
+            self._check_fan_out(self._fan_out(_delete_remote, remotes.keys()))
 
         except exc.NoResultFound:
             raise exceptions.SapiNotFound(message=("tor %s could not be found" %(id)))
 
+    def _join_tor(self, tor, src):
+        """Tunnel an existing tor to a new one at src."""
+        mgr = tor["tor_ip"]
+        vsis = [v["vxlan"] for v in models_lv.get_vsis_by_tor(mgr)]
+
+        #make a new tunnel.
+        def _join(driver):
+            status, tunnel_id = driver.newtunnel(tor["tunnel_src_ip"], src)
+            if not status:
+                raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+
+            #ensure new tunnel associated with existed vsis
+            if not driver.ensureVxlanWithTunnel(vsis, [tunnel_id]):
+                self._undo_tunnels(driver, mgr, [tunnel_id])
+                raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+            return tunnel_id
+        def _applied(tunnel_id):
+            self.applied.add_tunnels(mgr, [tunnel_id])
+            self.applied.add_bindings(mgr, vsis, [tunnel_id])
+        tunnel_id = self._run_on_tor(tor["type"], mgr, _join, _applied)
+        models_lv.save_tunnel({"tor_ip":mgr,
+                               "tunnel_id":tunnel_id,
+                               "dst_addr":src})
+
     def create_tor(self, request, body=None, **kwargs):
         type, src, mgr = body["switch_type"], body["tunnel_src"], body["mgr"]
         existinging_tors = models.get_tors()
         existing_tunnel_ips = self.rpc.tunnel_sync(src, VXLAN)
-        tunnel_ids = []
-
-        #initialize the connection to the switch.
-        #TODO: make the initialization work inside the driver context.
-        if not self.switch_drivers[type].initialize(mgr, "sinanp", "sinanp"):
-            raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
 
         #select all vsis(vxlan) already existed on switch.
         vsis = [v["vxlan"] for v in models_lv.get_vsis_by_tor(mgr)]
-        for tunnel in existing_tunnel_ips["tunnels"]:
-            tunnel_ip = tunnel["ip_address"]
-            if tunnel_ip == src:
-                continue
-            #make a new tunnel.
-            status, tunnel_id = self.switch_drivers[type].newtunnel(src, tunnel_ip)
-            if not status:
-                raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
-            tunnel_ids.append(tunnel_id)
-            models_lv.save_tunnel({"tor_ip":mgr,
-                                   "tunnel_id":tunnel_id,
-                                   "dst_addr":tunnel_ip})
 
-        #ensure all vsis associated with each new tunnels
-        if not self.switch_drivers[type].ensureVxlanWithTunnel(vsis, tunnel_ids):
-            raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+        #every edit on the new switch is applied in one go.
+        def _setup(driver):
+            tunnel_ids = []
+            tunnels = []
+            try:
+                for tunnel in existing_tunnel_ips["tunnels"]:
+                    tunnel_ip = tunnel["ip_address"]
+                    if tunnel_ip == src:
+                        continue
+                    #make a new tunnel.
+                    status, tunnel_id = driver.newtunnel(src, tunnel_ip)
+                    if not status:
+                        raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+                    tunnel_ids.append(tunnel_id)
+                    tunnels.append({"tor_ip":mgr,
+                                    "tunnel_id":tunnel_id,
+                                    "dst_addr":tunnel_ip})
+
+                #ensure all vsis associated with each new tunnels
+                if not driver.ensureVxlanWithTunnel(vsis, tunnel_ids):
+                    raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+            except Exception:
+                self._undo_tunnels(driver, mgr, tunnel_ids)
+                raise
+            return tunnels
+        def _applied(tunnels):
+            tunnel_ids = [t["tunnel_id"] for t in tunnels]
+            self.applied.add_tunnels(mgr, tunnel_ids)
+            self.applied.add_bindings(mgr, vsis, tunnel_ids)
+        tunnels = self._run_on_tor(type, mgr, _setup, _applied)
+        for tunnel in tunnels:
+            models_lv.save_tunnel(tunnel)
         models.save_tor({"type":type, "tunnel_src_ip":src, "tor_ip":mgr})
 
-        #make a full coverage tunnel sync, we should also configure the existing switch.
-        for _, tor in existinging_tors.items():
-            mgr = tor["tor_ip"]
-            vsis = [v["vxlan"] for v in models_lv.get_vsis_by_tor(mgr)]
-            type = models.get_tor(mgr)["type"]
-
-            #initialize the driver context and make a new tunnel.
-            if not self.switch_drivers[tor["type"]].initialize(mgr, "sinanp", "sinanp"):
-                raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
-            status, tunnel_id = self.switch_drivers[type].newtunnel(tor["tunnel_src_ip"], src)
-            if not status:
-                raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
+        #make a full coverage tunnel sync, we should also configure the
+        #existing switches, all of them at the same time.
+        failed = self._fan_out(lambda tor: self._join_tor(tor, src),
+                               existinging_tors.values())
+        self._check_fan_out(failed)
+
+    def _desired_state(self, tor):
+        tor_ip = tor["tor_ip"]
+        tunnels = dict((t["tunnel_id"], (tor["tunnel_src_ip"], t["dst_addr"]))
+                       for t in models_lv.get_tunnels_by_tor(tor_ip))
+        vxlans = set(v["vxlan"] for v in models_lv.get_vsis_by_tor(tor_ip))
+        nets = models.get_nets()
+        ports = {}
+        for pvm in models_lv.get_port_vlan_mappings_by_tor(tor_ip):
+            net = nets.get(pvm["network_id"])
+            if net:
+                ports[(pvm["index"], pvm["vlan_id"])] = net["segmentation_id"]
+        return {"tunnels":tunnels, "vxlans":vxlans, "ports":ports}
+
+    def reconcile_tor(self, tor_ip):
+        """Push the difference between the database and the live config of
+        a tor, e.g. after the switch was replaced or rebooted."""
+        tor = models.get_tor(tor_ip)
+        desired = self._desired_state(tor)
+        def _applied(result):
+            if result is None or result["failed"]:
+                return
+            tunnel_ids = desired["tunnels"].keys()
+            self.applied.add_tunnels(tor_ip, tunnel_ids)
+            for vxlan in desired["vxlans"]:
+                self.applied.add_vsi(tor_ip, vxlan)
+            self.applied.add_bindings(tor_ip, desired["vxlans"], tunnel_ids)
+        result = self._run_on_tor(tor["type"], tor_ip,
+                                  lambda driver: driver.reconcile(desired), _applied)
+        if result is None:
+            raise exceptions.SapiTorConfigError("tor %s config error" %(tor_ip))
+        return result
+
+    def create_reconcile(self, request, body=None, **kwargs):
+        tor_ip = (body or {}).get("tor_ip")
+        try:
+            if tor_ip:
+                return {"reconcile": {tor_ip: self.reconcile_tor(tor_ip)}}
+        except exc.NoResultFound:
+            raise exceptions.SapiNotFound(message=("tor %s could not be found" %(tor_ip)))
 
-            #ensure new tunnel associated with existed vsis
-            if not self.switch_drivers[type].ensureVxlanWithTunnel(vsis, [tunnel_id]):
-                raise exceptions.SapiTorConfigError("tor %s config error" %(mgr))
-            models_lv.save_tunnel({"tor_ip":mgr,
-                                   "tunnel_id":tunnel_id,
-                                   "dst_addr":src})
+        results = {}
+        def _reconcile(tor_ip):
+            results[tor_ip] = self.reconcile_tor(tor_ip)
+        self._check_fan_out(self._fan_out(_reconcile, models.get_tors().keys()))
+        return {"reconcile": results}
 
     def index_topology(self, request, **kwargs):
-        return {"topology":self.tors.topology,
-                "topology_sp":self.tors.topology_sp}
+        """The topology as last read, never waiting for a switch; age is
+        the seconds since its oldest part was read."""
+        snapshot = self.tors.snapshot()
+        return {"topology":snapshot.topology,
+                "topology_sp":snapshot.topology_sp,
+                "missing":sorted(snapshot.missing),
+                "age":snapshot.age}
+
+    def index_health(self, request, **kwargs):
+        return {"health":self.health.status()}
+
+    def index_metrics(self, request, **kwargs):
+        """Switch RPC latency, reply size and error counts, for a single
+        tor with ?switch=<tor_ip>."""
+        switch = request.GET.get("switch") if request else None
+        return {"metrics":metrics.snapshot(switch)}
 
 def get_instance():
     return Sapi()
@@ -0,0 +1,701 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""A stand-in for H3C switches speaking NETCONF over SSH.
+
+Every simulated switch listens on its own address and keeps the L2VPN
+VSI/SRV/AC, VXLAN and TUNNEL tables used by torconf.h3c in memory,
+with a running and a candidate datastore, and answers gets of its
+LLDP neighbours (--hosts per switch), also over SNMP with --snmp-port.
+RPCs can be slowed down and
+made to fail, so the drivers and the API can be load tested against a
+whole fabric on one box:
+
+    python -m torconf.simulator --switches 100 --base-ip 127.0.1.1 \\
+        --port 8300 --latency 0.02 --jitter 0.01 --failure-rate 0.001
+
+Point [netconf] port of sapi at the same port and register the
+simulated addresses as tors.
+"""
+import argparse
+import bisect
+import copy
+import random
+import socket
+import threading
+import time
+
+import lxml.etree as etree
+import paramiko
+
+from torconf import snmp
+
+NC_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+CONFIG_NS = "http://www.h3c.com/netconf/config:1.0"
+DATA_NS = "http://www.h3c.com/netconf/data:1.0"
+EOM = "]]>]]>"
+
+CAPABILITIES = [
+    "urn:ietf:params:netconf:base:1.0",
+    "urn:ietf:params:netconf:capability:candidate:1.0",
+    "urn:ietf:params:netconf:capability:writable-running:1.0",
+]
+
+#(module, table): (entry, key fields, other fields), nested leaves are
+#written as paths.
+TABLES = {
+    ('L2VPN', 'VSIs'): ('VSI', ['VsiName'], []),
+    ('L2VPN', 'SRVs'): ('SRV', ['IfIndex', 'SrvID'], ['Encap', 'SVlanRange']),
+    ('L2VPN', 'ACs'): ('AC', ['IfIndex', 'SrvID'], ['VsiName']),
+    ('VXLAN', 'VXLANs'): ('Vxlan', ['VxlanID'], ['VsiName']),
+    ('VXLAN', 'Tunnels'): ('Tunnel', ['VxlanID', 'TunnelID'], []),
+    ('TUNNEL', 'Tunnels'): ('Tunnel', ['ID'], ['Mode', 'IPv4Addr/SrcAddr',
+                                               'IPv4Addr/DstAddr']),
+}
+
+#fields of an entry which must name an existing entry of another table.
+REFERENCES = {
+    ('L2VPN', 'ACs'): [(['VsiName'], ('L2VPN', 'VSIs')),
+                       (['IfIndex', 'SrvID'], ('L2VPN', 'SRVs'))],
+    ('VXLAN', 'VXLANs'): [(['VsiName'], ('L2VPN', 'VSIs'))],
+    ('VXLAN', 'Tunnels'): [(['VxlanID'], ('VXLAN', 'VXLANs')),
+                           (['TunnelID'], ('TUNNEL', 'Tunnels'))],
+}
+
+#LLDP tables answered to a get, with the fields of their entries.
+LLDP_TABLES = [
+    ('LocalSystem', None, ['ChassisID', 'SystemName', 'SystemDescription']),
+    ('LocalPorts', 'Port', ['IfIndex', 'PortID']),
+    ('Neighbors', 'Neighbor', ['IfIndex', 'ChassisID', 'PortDescription',
+                               'SystemName', 'SystemDescription',
+                               'ManagementAddress']),
+]
+
+LLDP_MIB = (1, 0, 8802, 1, 1, 2, 1)
+
+#tables whose entries go away with the entry they refer to, as the vxlan
+#to tunnel bindings do on the switches.
+CASCADE = set([('VXLAN', 'Tunnels')])
+
+
+def _local(tag):
+    if not isinstance(tag, basestring):
+        return None
+    return tag.rpartition('}')[2]
+
+
+class RPCFailure(Exception):
+    def __init__(self, message, tag='operation-failed', path=None):
+        super(RPCFailure, self).__init__(message)
+        self.tag = tag
+        self.path = path
+
+
+class SwitchState(object):
+    """Running and candidate datastores of one switch."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.owner = None
+        self.running = dict((table, {}) for table in TABLES)
+        self.candidate = copy.deepcopy(self.running)
+        self.stats = {"rpcs": 0, "edits": 0, "failures": 0}
+        #LLDP neighbours by ifindex, lldp_version counts their changes.
+        self.neighbors = {}
+        self.lldp_version = 0
+
+    def datastore(self, target):
+        return self.candidate if target == 'candidate' else self.running
+
+    def edit(self, target, config, continue_on_error):
+        """Apply the entries of a <config> in document order."""
+        store = self.datastore(target)
+        errors = []
+        for top in config:
+            for module in top:
+                for table in module:
+                    key = (_local(module.tag), _local(table.tag))
+                    if key not in TABLES:
+                        errors.append(RPCFailure("unknown table %s/%s" % key,
+                                                 'unknown-element'))
+                        continue
+                    for entry in table:
+                        if not isinstance(entry.tag, basestring):
+                            continue
+                        try:
+                            self._edit_entry(store, key, entry)
+                        except RPCFailure as e:
+                            errors.append(e)
+                            if not continue_on_error:
+                                return errors
+        return errors
+
+    def _operation(self, element):
+        while element is not None:
+            op = element.get('{%s}operation' % NC_NS)
+            if op:
+                return op
+            element = element.getparent()
+        return 'merge'
+
+    def _fields(self, entry):
+        fields = {}
+        for e in entry.iter():
+            if e is entry or not isinstance(e.tag, basestring) or len(e):
+                continue
+            path = []
+            node = e
+            while node is not entry:
+                path.insert(0, _local(node.tag))
+                node = node.getparent()
+            fields['/'.join(path)] = (e.text or '').strip()
+        return fields
+
+    def _path(self, key, name, keys, values):
+        return "/top/%s/%s/%s%s" % (key[0], key[1], name, ''.join(
+            "[%s=%s]" % (k, v) for k, v in zip(keys, values)))
+
+    def _edit_entry(self, store, key, entry):
+        name, keys, _ = TABLES[key]
+        fields = self._fields(entry)
+        try:
+            values = tuple(fields[k] for k in keys)
+        except KeyError:
+            raise RPCFailure("missing key of %s" % name, 'missing-element')
+        path = self._path(key, name, keys, values)
+        rows = store[key]
+        op = self._operation(entry)
+        if op in ('remove', 'delete'):
+            if values not in rows:
+                if op == 'delete':
+                    raise RPCFailure("entry does not exist", 'data-missing', path)
+                return
+            self._release(store, key, values, path)
+            del rows[values]
+            return
+        if op == 'create' and values in rows:
+            raise RPCFailure("entry exists", 'data-exists', path)
+        for ref_fields, target in REFERENCES.get(key, []):
+            row = dict(rows.get(values, {}), **fields)
+            ref = tuple(row.get(f) for f in ref_fields)
+            if None not in ref and ref not in store[target]:
+                raise RPCFailure("%s %s does not exist" % (target[1], ref),
+                                 'invalid-value', path)
+        if op == 'replace' or values not in rows:
+            rows[values] = fields
+        else:
+            rows[values].update(fields)
+
+    def _release(self, store, key, values, path):
+        """Drop the entries depending on key/values, unless one forbids it."""
+        dependents = []
+        for source, refs in REFERENCES.items():
+            for ref_fields, target in refs:
+                if target != key:
+                    continue
+                for k, row in store[source].items():
+                    if tuple(row.get(f) for f in ref_fields) != values:
+                        continue
+                    if source not in CASCADE:
+                        raise RPCFailure("entry in use by %s" % source[1],
+                                         'operation-failed', path)
+                    dependents.append((source, k))
+        for source, k in dependents:
+            store[source].pop(k, None)
+
+    def cable(self, hosts):
+        """Put an LLDP neighbour behind each of the first hosts ports."""
+        self.lldp_version += 1
+        for index in range(1, hosts + 1):
+            self.neighbors[index] = {
+                'IfIndex': str(index),
+                'ChassisID': "02:00:%02x:%02x:%02x:%02x" % (
+                    hash(self.name) & 0xff, (hash(self.name) >> 8) & 0xff,
+                    index >> 8, index & 0xff),
+                'PortDescription': "eth0",
+                'SystemName': "%s-host%d" % (self.name, index),
+                'SystemDescription': "Linux",
+                'ManagementAddress': "10.%d.%d.%d" % (
+                    (hash(self.name) >> 16) & 0xff, index >> 8, index & 0xff),
+            }
+
+    def lldp_mib(self):
+        """The LLDP MIB of the switch as sorted (oid, value) pairs."""
+        def octets(mac):
+            return ''.join(chr(int(b, 16)) for b in mac.split(':'))
+        local, remote = LLDP_MIB + (3,), LLDP_MIB + (4,)
+        system = self._lldp_entries('LocalSystem')[0]
+        mib = [(local + (1, 0), 4),
+               (local + (2, 0), octets(system['ChassisID'])),
+               (local + (3, 0), system['SystemName']),
+               (local + (4, 0), system['SystemDescription']),
+               (local + (5, 0), '\x28\x00'),
+               (local + (6, 0), '\x28\x00')]
+        for port in self._lldp_entries('LocalPorts'):
+            index = int(port['IfIndex'])
+            mib += [(local + (7, 1, 2, index), 5),
+                    (local + (7, 1, 3, index), port['PortID']),
+                    (local + (7, 1, 4, index), port['PortID'] + " Interface")]
+        address = (1, 4, 192, 0, 2, 1)
+        mib += [(local + (8, 1, 3) + address, 5),
+                (local + (8, 1, 4) + address, 2),
+                (local + (8, 1, 5) + address, 1),
+                (local + (8, 1, 6) + address, (0, 0))]
+        for neighbor in self._lldp_entries('Neighbors'):
+            index = (0, int(neighbor['IfIndex']), 1)
+            mib += [(remote + (1, 1, 4) + index, 4),
+                    (remote + (1, 1, 5) + index, octets(neighbor['ChassisID'])),
+                    (remote + (1, 1, 6) + index, 3),
+                    (remote + (1, 1, 7) + index, octets(neighbor['ChassisID'])),
+                    (remote + (1, 1, 8) + index, neighbor['PortDescription']),
+                    (remote + (1, 1, 9) + index, neighbor['SystemName']),
+                    (remote + (1, 1, 10) + index, neighbor['SystemDescription']),
+                    (remote + (1, 1, 11) + index, '\x80\x00'),
+                    (remote + (1, 1, 12) + index, '\x80\x00')]
+            address = (1, 4) + tuple(int(b) for b in
+                                     neighbor['ManagementAddress'].split('.'))
+            mib += [(remote + (2, 1, 3) + index + address, 2),
+                    (remote + (2, 1, 4) + index + address, 0),
+                    (remote + (2, 1, 5) + index + address, (0, 0))]
+        mib.sort()
+        return mib
+
+    def _lldp_entries(self, table):
+        if table == 'LocalSystem':
+            return [{'ChassisID': "02:00:00:00:00:01", 'SystemName': self.name,
+                     'SystemDescription': "H3C Comware Software"}]
+        if table == 'LocalPorts':
+            return [{'IfIndex': str(index),
+                     'PortID': "Ten-GigabitEthernet1/0/%d" % index}
+                    for index in range(1, max(48, len(self.neighbors)) + 1)]
+        return [self.neighbors[index] for index in sorted(self.neighbors)]
+
+    def _render_lldp(self, module, ns, tables):
+        for table, entry, fields in LLDP_TABLES:
+            if tables and table not in tables:
+                continue
+            t = etree.SubElement(module, '{%s}%s' % (ns, table))
+            for values in self._lldp_entries(table):
+                e = etree.SubElement(t, '{%s}%s' % (ns, entry)) if entry else t
+                for field in fields:
+                    etree.SubElement(e, '{%s}%s' % (ns, field)).text = values[field]
+
+    def available_tunnel_id(self):
+        used = set(int(v[0]) for v in self.running[('TUNNEL', 'Tunnels')])
+        id = 1
+        while id in used:
+            id += 1
+        return id
+
+    def render(self, store, filter, ns, state):
+        """Render the tables selected by a subtree filter."""
+        top = etree.Element('{%s}top' % ns, nsmap={None: ns})
+        wanted = []
+        for module in (filter if filter is not None else []):
+            tables = [t for t in module if isinstance(t.tag, basestring)]
+            wanted.append((_local(module.tag), [_local(t.tag) for t in tables]))
+        for module, tables in wanted:
+            m = etree.SubElement(top, '{%s}%s' % (ns, module))
+            if module == 'Device':
+                base = etree.SubElement(m, '{%s}Base' % ns)
+                etree.SubElement(base, '{%s}HostName' % ns).text = self.name
+                continue
+            if module == 'LLDP':
+                if state:
+                    self._render_lldp(m, ns, tables)
+                continue
+            if not tables:
+                tables = [t for mod, t in TABLES if mod == module]
+            for table in tables:
+                if table == 'AvailableTunnelID':
+                    if state:
+                        t = etree.SubElement(m, '{%s}AvailableTunnelID' % ns)
+                        etree.SubElement(t, '{%s}ID' % ns).text = \
+                            str(self.available_tunnel_id())
+                    continue
+                if (module, table) not in TABLES:
+                    continue
+                t = etree.SubElement(m, '{%s}%s' % (ns, table))
+                name, keys, others = TABLES[(module, table)]
+                for fields in store[(module, table)].values():
+                    entry = etree.SubElement(t, '{%s}%s' % (ns, name))
+                    for field in keys + others:
+                        if field not in fields:
+                            continue
+                        node = entry
+                        for part in field.split('/'):
+                            child = node.find('{%s}%s' % (ns, part))
+                            if child is None:
+                                child = etree.SubElement(node, '{%s}%s' % (ns, part))
+                            node = child
+                        node.text = fields[field]
+        return top
+
+
+class Behaviour(object):
+    """Latency, jitter and failure injection of the simulated switches."""
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 disconnect_rate=0.0, connect_latency=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.disconnect_rate = disconnect_rate
+        self.connect_latency = connect_latency
+
+    def delay(self):
+        wait = self.latency + random.uniform(-self.jitter, self.jitter)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class _SSHServer(paramiko.ServerInterface):
+    def __init__(self, user, passwd):
+        self.user = user
+        self.passwd = passwd
+        self.netconf = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if self.user is None or (username, password) == (self.user, self.passwd):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_subsystem_request(self, channel, name):
+        if name == 'netconf':
+            self.netconf.set()
+            return True
+        return False
+
+
+class _Session(object):
+    """One NETCONF session on a channel, framed with ]]>]]>."""
+
+    def __init__(self, switch, channel, session_id):
+        self.switch = switch
+        self.channel = channel
+        self.session_id = session_id
+        self.buffer = ''
+
+    def run(self):
+        self.send(self.hello())
+        while True:
+            message = self.read()
+            if message is None:
+                break
+            try:
+                root = etree.fromstring(message.strip())
+            except etree.XMLSyntaxError:
+                continue
+            if _local(root.tag) == 'hello':
+                continue
+            if not self.handle(root):
+                break
+        self.release()
+        self.channel.close()
+
+    def hello(self):
+        caps = ''.join("<capability>%s</capability>" % c for c in CAPABILITIES)
+        return ('<hello xmlns="%s"><capabilities>%s</capabilities>'
+                '<session-id>%d</session-id></hello>' % (NC_NS, caps, self.session_id))
+
+    def read(self):
+        while EOM not in self.buffer:
+            data = self.channel.recv(65536)
+            if not data:
+                return None
+            self.buffer += data
+        message, self.buffer = self.buffer.split(EOM, 1)
+        return message
+
+    def send(self, message):
+        self.channel.sendall(message + EOM)
+
+    def release(self):
+        state = self.switch.state
+        with state.lock:
+            if state.owner == self.session_id:
+                state.owner = None
+
+    def reply(self, rpc, body):
+        attrs = ''.join(' %s="%s"' % (k, v) for k, v in rpc.attrib.items())
+        return '<rpc-reply xmlns="%s"%s>%s</rpc-reply>' % (NC_NS, attrs, body)
+
+    def error(self, e):
+        path = "<error-path>%s</error-path>" % e.path if e.path else ""
+        return ("<rpc-error><error-type>application</error-type>"
+                "<error-tag>%s</error-tag><error-severity>error</error-severity>"
+                "%s<error-message>%s</error-message></rpc-error>"
+                % (e.tag, path, str(e)))
+
+    def handle(self, rpc):
+        behaviour = self.switch.behaviour
+        state = self.switch.state
+        op = rpc[0] if len(rpc) else None
+        name = _local(op.tag) if op is not None else None
+        behaviour.delay()
+        state.stats["rpcs"] += 1
+        if random.random() < behaviour.disconnect_rate:
+            return False
+        if random.random() < behaviour.failure_rate:
+            state.stats["failures"] += 1
+            self.send(self.reply(rpc, self.error(RPCFailure("injected failure"))))
+            return True
+        if name in ('close-session', 'kill-session'):
+            self.send(self.reply(rpc, "<ok/>"))
+            return False
+        try:
+            with state.lock:
+                body = self.dispatch(name, op)
+        except RPCFailure as e:
+            state.stats["failures"] += 1
+            body = self.error(e)
+        self.send(self.reply(rpc, body))
+        return True
+
+    def _target(self, op, name):
+        node = op.find('{%s}%s' % (NC_NS, name))
+        if node is None or not len(node):
+            raise RPCFailure("missing %s" % name, 'missing-element')
+        return _local(node[0].tag)
+
+    def _filter(self, op):
+        node = op.find('{%s}filter' % NC_NS)
+        if node is None or not len(node):
+            return None
+        return node[0]
+
+    def dispatch(self, name, op):
+        state = self.switch.state
+        if name == 'edit-config':
+            target = self._target(op, 'target')
+            self._check_lock(target)
+            error_option = op.findtext('{%s}error-option' % NC_NS)
+            config = op.find('{%s}config' % NC_NS)
+            state.stats["edits"] += 1
+            errors = state.edit(target, config, error_option == 'continue-on-error')
+            if errors:
+                state.stats["failures"] += 1
+                return ''.join(self.error(e) for e in errors)
+            return "<ok/>"
+        if name in ('get', 'get-config'):
+            source = 'running'
+            if name == 'get-config':
+                source = self._target(op, 'source')
+            ns = DATA_NS if name == 'get' else CONFIG_NS
+            top = state.render(state.datastore(source), self._filter(op),
+                               ns, name == 'get')
+            return "<data>%s</data>" % etree.tostring(top)
+        if name == 'lock':
+            if state.owner not in (None, self.session_id):
+                raise RPCFailure("locked by session %s" % state.owner, 'lock-denied')
+            state.owner = self.session_id
+            return "<ok/>"
+        if name == 'unlock':
+            if state.owner == self.session_id:
+                state.owner = None
+            return "<ok/>"
+        if name == 'commit':
+            state.running = copy.deepcopy(state.candidate)
+            return "<ok/>"
+        if name == 'discard-changes':
+            state.candidate = copy.deepcopy(state.running)
+            return "<ok/>"
+        raise RPCFailure("%s not supported" % name, 'operation-not-supported')
+
+    def _check_lock(self, target):
+        owner = self.switch.state.owner
+        if target == 'candidate' and owner not in (None, self.session_id):
+            raise RPCFailure("locked by session %s" % owner, 'in-use')
+
+
+class _SNMPAgent(object):
+    """Answers SNMPv2c GETNEXT and GETBULK requests on the LLDP MIB."""
+
+    def __init__(self, state, sock):
+        self.state = state
+        self.sock = sock
+        self.mib = None
+        self.version = None
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except socket.error:
+                return
+            try:
+                reply = self.answer(snmp.decode_message(data))
+            except snmp.SNMPError:
+                continue
+            self.sock.sendto(reply, addr)
+
+    def answer(self, request):
+        community, pdu_type, request_id, a, b, varbinds = request
+        if self.version != self.state.lldp_version:
+            self.version = self.state.lldp_version
+            self.mib = self.state.lldp_mib()
+        oids = [oid for oid, value in self.mib]
+        if pdu_type == snmp.GET_BULK_REQUEST:
+            non_repeaters, repetitions = a, b
+        else:
+            non_repeaters, repetitions = len(varbinds), 0
+        names = [oid for oid, _ in varbinds]
+        positions = [bisect.bisect_right(oids, oid) for oid in names]
+        def successor(i):
+            pos = positions[i]
+            if pos >= len(oids):
+                return names[i], snmp.END_OF_MIB_VIEW
+            positions[i] += 1
+            names[i] = oids[pos]
+            return self.mib[pos]
+        #the repeaters come row by row, as the RFC 3416 GETBULK does.
+        rows = [range(min(non_repeaters, len(names)))]
+        rows += [range(non_repeaters, len(names))] * repetitions
+        result = [successor(i) for row in rows for i in row]
+        result = [(oid, snmp.encode_value(value)) for oid, value in result]
+        self.state.stats["rpcs"] += 1
+        return snmp.encode_message(community, snmp.RESPONSE, request_id, 0, 0, result)
+
+
+class SimulatedSwitch(object):
+    """A switch listening for NETCONF over SSH on (host, port)."""
+
+    _session_ids = iter(xrange(1, 1 << 31))
+
+    def __init__(self, host, port, host_key, behaviour,
+                 user=None, passwd=None, snmp_port=0):
+        self.host = host
+        self.snmp_port = snmp_port
+        self.snmp_sock = None
+        self.port = port
+        self.host_key = host_key
+        self.behaviour = behaviour
+        self.user = user
+        self.passwd = passwd
+        self.state = SwitchState("sim-%s" % host)
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(128)
+        self._spawn(self._accept)
+        if self.snmp_port:
+            self.snmp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.snmp_sock.bind((self.host, self.snmp_port))
+            self._spawn(_SNMPAgent(self.state, self.snmp_sock).run)
+
+    def stop(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        if self.snmp_sock:
+            self.snmp_sock.close()
+            self.snmp_sock = None
+
+    def _spawn(self, func, *args):
+        t = threading.Thread(target=func, args=args)
+        t.daemon = True
+        t.start()
+
+    def _accept(self):
+        while self.sock:
+            try:
+                client, _ = self.sock.accept()
+            except socket.error:
+                return
+            self._spawn(self._serve, client)
+
+    def _serve(self, client):
+        if self.behaviour.connect_latency:
+            time.sleep(self.behaviour.connect_latency)
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        server = _SSHServer(self.user, self.passwd)
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(30)
+            if channel is None or not server.netconf.wait(30):
+                return
+            _Session(self, channel, next(self._session_ids)).run()
+        except Exception:
+            pass
+        finally:
+            transport.close()
+
+
+def start_fabric(count, base_ip, port, behaviour, user=None, passwd=None,
+                 hosts=0, snmp_port=0):
+    """Start count switches on consecutive addresses from base_ip, each
+    with hosts LLDP neighbours, answering SNMP on snmp_port unless 0."""
+    host_key = paramiko.RSAKey.generate(2048)
+    first = struct_ip(base_ip)
+    switches = []
+    for i in range(count):
+        switch = SimulatedSwitch(ip_str(first + i), port, host_key,
+                                 behaviour, user, passwd, snmp_port)
+        switch.state.cable(hosts)
+        switch.start()
+        switches.append(switch)
+    return switches
+
+
+def struct_ip(ip):
+    return reduce(lambda a, b: (a << 8) + int(b), ip.split('.'), 0)
+
+
+def ip_str(num):
+    return '.'.join(str((num >> shift) & 0xff) for shift in (24, 16, 8, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulated H3C NETCONF switches")
+    parser.add_argument('--switches', type=int, default=1)
+    parser.add_argument('--base-ip', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8300)
+    parser.add_argument('--hosts', type=int, default=0,
+                        help="LLDP neighbours of every switch")
+    parser.add_argument('--snmp-port', type=int, default=0,
+                        help="UDP port answering SNMP on the LLDP MIB, 0 disables")
+    parser.add_argument('--user', default=None)
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every RPC")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="random seconds added to or taken from the latency")
+    parser.add_argument('--connect-latency', type=float, default=0.0,
+                        help="seconds added to every SSH handshake")
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help="share of RPCs answered with an rpc-error")
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help="share of RPCs dropping the session")
+    args = parser.parse_args()
+
+    behaviour = Behaviour(args.latency, args.jitter, args.failure_rate,
+                          args.disconnect_rate, args.connect_latency)
+    switches = start_fabric(args.switches, args.base_ip, args.port, behaviour,
+                            args.user, args.password, args.hosts,
+                            args.snmp_port)
+    print "%d switches from %s port %d" % (len(switches), args.base_ip, args.port)
+    try:
+        while True:
+            time.sleep(10)
+            rpcs = sum(s.state.stats["rpcs"] for s in switches)
+            failures = sum(s.state.stats["failures"] for s in switches)
+            print "rpcs %d failures %d" % (rpcs, failures)
+    except KeyboardInterrupt:
+        for switch in switches:
+            switch.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""A minimal SNMPv2c client walking MIB subtrees with GETBULK.
+
+All requests go out of one UDP socket and are matched with their
+responses by request-id, so green threads walk any number of switches
+at once without forking snmpwalk. Values are decoded into python types:
+INTEGER and the counters to int, OCTET STRING and Opaque to str, OBJECT
+IDENTIFIER to a tuple of arcs and IpAddress to a dotted string.
+"""
+import random
+import itertools
+
+import eventlet
+from eventlet import event
+from eventlet.green import socket
+from oslo.config import cfg
+
+snmp_opts = [
+    cfg.StrOpt('community', default='public',
+               help="SNMPv2c community of the tors"),
+    cfg.IntOpt('port', default=161,
+               help="UDP port the SNMP agents of the tors listen on"),
+    cfg.FloatOpt('timeout', default=2,
+                 help="Seconds to wait for the response to a request"),
+    cfg.IntOpt('retries', default=2,
+               help="Times a request without response is sent again"),
+    cfg.IntOpt('max_repetitions', default=25,
+               help="Variable bindings asked for in one GETBULK request"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(snmp_opts, group='snmp')
+
+VERSION_2C = 1
+
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+
+GET_NEXT_REQUEST = 0xa1
+RESPONSE = 0xa2
+GET_BULK_REQUEST = 0xa5
+
+UNSIGNED = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+
+
+class _VarBindException(object):
+    """A value standing for one of the varbind exceptions."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+NO_SUCH_OBJECT = _VarBindException('noSuchObject')
+NO_SUCH_INSTANCE = _VarBindException('noSuchInstance')
+END_OF_MIB_VIEW = _VarBindException('endOfMibView')
+
+_EXCEPTIONS = {0x80: NO_SUCH_OBJECT, 0x81: NO_SUCH_INSTANCE, 0x82: END_OF_MIB_VIEW}
+
+
+class SNMPError(RuntimeError):
+    pass
+
+
+class SNMPTimeout(SNMPError):
+    pass
+
+
+def parse_oid(oid):
+    """'1.3.6.1' or '.1.3.6.1' to (1, 3, 6, 1)."""
+    if isinstance(oid, tuple):
+        return oid
+    return tuple(int(arc) for arc in oid.strip('.').split('.'))
+
+
+def _length(n):
+    if n < 0x80:
+        return chr(n)
+    s = ''
+    while n:
+        s = chr(n & 0xff) + s
+        n >>= 8
+    return chr(0x80 | len(s)) + s
+
+
+def _tlv(tag, body):
+    return chr(tag) + _length(len(body)) + body
+
+
+def _integer(n, tag=INTEGER):
+    body = ''
+    while True:
+        body = chr(n & 0xff) + body
+        n >>= 8
+        sign = ord(body[0]) & 0x80
+        if (n == 0 and not sign) or (n == -1 and sign):
+            break
+    if tag in UNSIGNED and ord(body[0]) & 0x80:
+        body = '\0' + body
+    return _tlv(tag, body)
+
+
+def _oid(oid):
+    arcs = [oid[0] * 40 + oid[1]] + list(oid[2:])
+    body = ''
+    for arc in arcs:
+        chunk = chr(arc & 0x7f)
+        arc >>= 7
+        while arc:
+            chunk = chr(0x80 | (arc & 0x7f)) + chunk
+            arc >>= 7
+        body += chunk
+    return _tlv(OBJECT_IDENTIFIER, body)
+
+
+def encode_value(value):
+    """BER encode a varbind value, None as NULL."""
+    if value is None:
+        return _tlv(NULL, '')
+    if isinstance(value, _VarBindException):
+        tag = [t for t, e in _EXCEPTIONS.items() if e is value][0]
+        return _tlv(tag, '')
+    if isinstance(value, bool) or isinstance(value, (int, long)):
+        return _integer(int(value))
+    if isinstance(value, tuple):
+        return _oid(value)
+    return _tlv(OCTET_STRING, value)
+
+
+def encode_message(community, pdu_type, request_id, a, b, varbinds):
+    """An SNMPv2c message, a and b being error-status and error-index,
+    or non-repeaters and max-repetitions of a GETBULK. varbinds are
+    (oid, encoded value) pairs."""
+    bindings = ''.join(_tlv(SEQUENCE, _oid(oid) + value) for oid, value in varbinds)
+    pdu = _tlv(pdu_type, _integer(request_id) + _integer(a) + _integer(b) +
+               _tlv(SEQUENCE, bindings))
+    return _tlv(SEQUENCE, _integer(VERSION_2C) + _tlv(OCTET_STRING, community) + pdu)
+
+
+def _read(data, pos):
+    """Return the tag, body and end of the TLV at pos."""
+    if pos + 2 > len(data):
+        raise SNMPError("truncated message")
+    tag, length = ord(data[pos]), ord(data[pos + 1])
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7f
+        length = 0
+        for c in data[pos:pos + n]:
+            length = (length << 8) | ord(c)
+        pos += n
+    if pos + length > len(data):
+        raise SNMPError("truncated message")
+    return tag, data[pos:pos + length], pos + length
+
+
+def _items(data):
+    pos = 0
+    while pos < len(data):
+        tag, body, pos = _read(data, pos)
+        yield tag, body
+
+
+def _decode_integer(body, signed=True):
+    n = 0
+    for c in body:
+        n = (n << 8) | ord(c)
+    if signed and body and ord(body[0]) & 0x80:
+        n -= 1 << (8 * len(body))
+    return n
+
+
+def _decode_oid(body):
+    arcs, arc = [], 0
+    for c in body:
+        arc = (arc << 7) | (ord(c) & 0x7f)
+        if not ord(c) & 0x80:
+            arcs.append(arc)
+            arc = 0
+    if not arcs:
+        return ()
+    first = min(arcs[0] // 40, 2)
+    return (first, arcs[0] - first * 40) + tuple(arcs[1:])
+
+
+def decode_value(tag, body):
+    if tag == INTEGER:
+        return _decode_integer(body)
+    if tag in (OCTET_STRING, OPAQUE):
+        return body
+    if tag == NULL:
+        return None
+    if tag == OBJECT_IDENTIFIER:
+        return _decode_oid(body)
+    if tag == IP_ADDRESS:
+        return '.'.join(str(ord(c)) for c in body)
+    if tag in UNSIGNED:
+        return _decode_integer(body, signed=False)
+    if tag in _EXCEPTIONS:
+        return _EXCEPTIONS[tag]
+    raise SNMPError("unknown value type 0x%02x" % tag)
+
+
+def decode_message(data):
+    """Return (community, pdu type, request-id, a, b, varbinds) of an
+    SNMPv2c message, see encode_message, with decoded varbind values."""
+    tag, message, _ = _read(data, 0)
+    if tag != SEQUENCE:
+        raise SNMPError("not an SNMP message")
+    fields = list(_items(message))
+    if len(fields) != 3 or _decode_integer(fields[0][1]) != VERSION_2C:
+        raise SNMPError("not an SNMPv2c message")
+    community = fields[1][1]
+    pdu_type, pdu = fields[2]
+    pdu = list(_items(pdu))
+    if len(pdu) != 4:
+        raise SNMPError("malformed PDU")
+    varbinds = []
+    for _, binding in _items(pdu[3][1]):
+        (_, name), (tag, value) = list(_items(binding))[:2]
+        varbinds.append((_decode_oid(name), decode_value(tag, value)))
+    return (community, pdu_type, _decode_integer(pdu[0][1]),
+            _decode_integer(pdu[1][1]), _decode_integer(pdu[2][1]), varbinds)
+
+
+class Client(object):
+    """SNMPv2c GETBULK requests over one UDP socket.
+
+    A green thread receives every response and wakes the request it
+    answers, so requests of any number of green threads are in flight
+    at once.
+    """
+
+    def __init__(self):
+        self._sock = None
+        self._pending = {}
+        self._ids = itertools.count(random.randint(1, 1 << 30))
+
+    def _socket(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            eventlet.spawn_n(self._receive, self._sock)
+        return self._sock
+
+    def _receive(self, sock):
+        while True:
+            try:
+                data, addr = sock.recvfrom(65535)
+            except socket.error:
+                if sock is not self._sock:
+                    return
+                continue
+            try:
+                message = decode_message(data)
+            except (SNMPError, ValueError, IndexError):
+                continue
+            pending = self._pending.get(message[2])
+            if pending and pending[0] == addr[0] and not pending[1].ready():
+                pending[1].send(message)
+
+    def _request_id(self):
+        return next(self._ids) % 0x7fffffff + 1
+
+    def request(self, host, pdu_type, a, b, oids):
+        """Send a request for oids to host, return the varbinds of its
+        response."""
+        sock = self._socket()
+        request_id = self._request_id()
+        packet = encode_message(CONF.snmp.community, pdu_type, request_id,
+                                a, b, [(parse_oid(oid), encode_value(None)) for oid in oids])
+        done = event.Event()
+        self._pending[request_id] = (host, done)
+        try:
+            for _ in range(max(CONF.snmp.retries, 0) + 1):
+                sock.sendto(packet, (host, CONF.snmp.port))
+                with eventlet.Timeout(CONF.snmp.timeout, False):
+                    done.wait()
+                if done.ready():
+                    break
+            else:
+                raise SNMPTimeout("no response from %s" % host)
+        finally:
+            del self._pending[request_id]
+        _, pdu_type, _, status, index, varbinds = done.wait()
+        if status:
+            raise SNMPError("%s answered error-status %d at %d" % (host, status, index))
+        return varbinds
+
+    def get_bulk(self, host, oids, max_repetitions=None, non_repeaters=0):
+        if max_repetitions is None:
+            max_repetitions = CONF.snmp.max_repetitions
+        return self.request(host, GET_BULK_REQUEST, non_repeaters,
+                            max(max_repetitions, 1), oids)
+
+    def walk(self, host, oid):
+        """Return the (oid, value) pairs of the subtree under oid, in
+        order."""
+        return self.walk_columns(host, [oid])
+
+    def walk_columns(self, host, columns, scalars=()):
+        """Walk the subtrees under columns side by side and get the first
+        instance under each of scalars.
+
+        Every GETBULK carries the position of each column still being
+        walked, the scalars go as non-repeaters of the first one, and
+        the max-repetitions are shared out between the columns so the
+        responses keep their size. Return the (oid, value) pairs of the
+        scalars, then of the columns as they come in.
+        """
+        roots = [parse_oid(oid) for oid in columns]
+        scalars = [parse_oid(oid) for oid in scalars]
+        current = dict(enumerate(roots))
+        result = []
+        while current or scalars:
+            active = sorted(current)
+            repetitions = CONF.snmp.max_repetitions // max(len(active), 1)
+            varbinds = self.get_bulk(host, scalars + [current[i] for i in active],
+                                     max(repetitions, 1), len(scalars))
+            for root, (name, value) in zip(scalars, varbinds):
+                if (not isinstance(value, _VarBindException) and
+                        name[:len(root)] == root):
+                    result.append((name, value))
+            varbinds = varbinds[len(scalars):]
+            scalars = []
+            done = set(active) if not varbinds else set()
+            for pos, (name, value) in enumerate(varbinds):
+                i = active[pos % len(active)]
+                if i in done:
+                    continue
+                if (isinstance(value, _VarBindException) or
+                        name[:len(roots[i])] != roots[i] or name <= current[i]):
+                    done.add(i)
+                    continue
+                result.append((name, value))
+                current[i] = name
+            for i in done:
+                del current[i]
+        return result
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock:
+            sock.close()
+
+
+CLIENT = Client()
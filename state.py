@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import collections
+
+from torconf import models_lv
+
+
+class AppliedState(object):
+    """What is known to be configured on every switch.
+
+    The cache is rebuilt from sapi_tor_vsis and sapi_tor_tunnels, where
+    every vsi of a tor is bound to every tunnel of that tor, and kept
+    up to date as driver calls succeed. Edits already recorded here do
+    not have to be sent again.
+    """
+
+    def __init__(self):
+        self._vsis = collections.defaultdict(set)
+        self._tunnels = collections.defaultdict(set)
+        self._bindings = collections.defaultdict(set)
+
+    def load(self):
+        self._vsis.clear()
+        self._tunnels.clear()
+        self._bindings.clear()
+        for vsi in models_lv.get_vsis():
+            self._vsis[vsi["tor_ip"]].add(vsi["vxlan"])
+        for tunnel in models_lv.get_tunnnels():
+            self._tunnels[tunnel["tor_ip"]].add(tunnel["tunnel_id"])
+        for tor_ip, vxlans in self._vsis.items():
+            self.add_bindings(tor_ip, vxlans, self._tunnels[tor_ip])
+
+    def unbound(self, tor_ip, vxlan, tunnel_ids):
+        """Return the tunnel_ids vxlan is not known to be bound to."""
+        bindings = self._bindings[tor_ip]
+        return [id for id in tunnel_ids if (vxlan, id) not in bindings]
+
+    def add_vsi(self, tor_ip, vxlan):
+        self._vsis[tor_ip].add(vxlan)
+
+    def remove_vsi(self, tor_ip, vxlan):
+        self._vsis[tor_ip].discard(vxlan)
+        self._bindings[tor_ip] = set(b for b in self._bindings[tor_ip]
+                                     if b[0] != vxlan)
+
+    def add_tunnels(self, tor_ip, tunnel_ids):
+        self._tunnels[tor_ip].update(tunnel_ids)
+
+    def remove_tunnels(self, tor_ip, tunnel_ids):
+        tunnel_ids = set(tunnel_ids)
+        self._tunnels[tor_ip] -= tunnel_ids
+        self._bindings[tor_ip] = set(b for b in self._bindings[tor_ip]
+                                     if b[1] not in tunnel_ids)
+
+    def add_bindings(self, tor_ip, vxlans, tunnel_ids):
+        bindings = self._bindings[tor_ip]
+        for vxlan in vxlans:
+            for id in tunnel_ids:
+                bindings.add((vxlan, id))
+
+    def forget(self, tor_ip):
+        for d in (self._vsis, self._tunnels, self._bindings):
+            d.pop(tor_ip, None)
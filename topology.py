@@ -1,10 +1,44 @@
 #!/usr/bin/env python
 # encoding: utf-8
+import time
 import traceback
+import collections
 
+import eventlet
+from oslo.config import cfg
+
+from torconf import snmp
 from torconf import utils
 from torconf import models_lv
 
+topology_opts = [
+    cfg.StrOpt('source', default='snmp',
+               help="Where the LLDP neighbours of the tors are read from: "
+                    "'snmp' walks the LLDP MIB, 'netconf' reads them over "
+                    "the sessions of the switch drivers and walks the MIB "
+                    "of the tors whose driver can not"),
+    cfg.StrOpt('snmp_client', default='snmpwalk',
+               help="How the LLDP MIB is walked: 'snmpwalk' forks the "
+                    "net-snmp snmpwalk, 'getbulk' walks it in process with "
+                    "SNMPv2c GETBULK, see [snmp]"),
+    cfg.IntOpt('discovery_concurrency', default=32,
+               help="Number of tors whose LLDP data is read at the same time"),
+    cfg.IntOpt('discovery_timeout', default=60,
+               help="Seconds the LLDP data of one tor may take to read, "
+                    "tors not answering in time are marked missing"),
+    cfg.IntOpt('refresh_interval', default=0,
+               help="Seconds between two slices of tors whose LLDP data is "
+                    "read again in the background, 0 disables the refresh"),
+    cfg.IntOpt('refresh_slice', default=8,
+               help="Number of tors read again in one refresh slice"),
+    cfg.IntOpt('rebuild_interval', default=30,
+               help="Least seconds between two background reads of the tors "
+                    "with no LLDP data, started by topology reads"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(topology_opts, group='topology')
+
 VLAN_VPC_MIN = 2
 VLAN_VPC_MAX = 4000
 VLAN_BASE_MIN = 4002
@@ -15,9 +49,12 @@ SHARED = 'shared'
 UNSHARED = 'unshared'
 SNMPWALK = 'snmpwalk'
 
-LLDP_LOCAL_OID = "1.0.8802.1.1.2.1.3"
-LLDP_REMOTE_OID = "1.0.8802.1.1.2.1.4"
+#kinds of the events published when a refresh finds a neighbour changed.
+HOST_ADDED = 'added'
+HOST_REMOVED = 'removed'
+HOST_CHANGED = 'changed'
 
+#the LLDP-MIB scalars and columns read, nothing else is walked.
 LLDP_LOCAL_ITEMS = [
     "iso.0.8802.1.1.2.1.3.2.0",
     "iso.0.8802.1.1.2.1.3.3.0",
@@ -34,27 +71,76 @@ LLDP_REMOTE_ITEMS = [
     "iso.0.8802.1.1.2.1.4.2.1.3"
 ]
 
+def _text(value):
+    """A walked value as snmpwalk prints it, binary strings in hex."""
+    if isinstance(value, str):
+        if all(32 <= ord(c) < 127 for c in value):
+            return value
+        return ' '.join("%02X" % ord(c) for c in value)
+    return str(value)
+
+#the topology as read up to some time, never changed afterwards. age is
+#the seconds since the tor read longest ago was read, None before all
+#tors were read once.
+Snapshot = collections.namedtuple('Snapshot', ['topology', 'topology_sp',
+                                               'missing', 'age'])
+
+def diff(tor_ip, old, new):
+    """The events turning the neighbours old of tor_ip into new, both
+    ifindex -> neighbour."""
+    events = []
+    for index in sorted(set(old) | set(new)):
+        before, after = old.get(index), new.get(index)
+        if before == after:
+            continue
+        if before is None:
+            kind = HOST_ADDED
+        elif after is None:
+            kind = HOST_REMOVED
+        else:
+            kind = HOST_CHANGED
+        events.append({"event": kind, "tor_ip": tor_ip, "index": index,
+                       "host": (after or before)["host"],
+                       "old": before, "new": after})
+    return events
+
 class TopofRacks(object):
-    def __init__(self, topofrack):
+    def __init__(self, topofrack, lldp=None):
         self._topofracks = topofrack
+        #lldp(tor_ip) returns (local, remote) read by the switch driver.
+        self._lldp = lldp
         self._topofracks_lvm = {}
         self._topofracks_lvm_cache = {}
+        #the topology dicts and missing are replaced, never changed, so
+        #a snapshot taken of them stays as it was.
         self._topology = {}
         self._topology_sp = {}
+        #tors whose LLDP data could not be read on the last discovery.
+        self._missing = frozenset()
+        #tor -> time its LLDP data was last read.
+        self._read_at = {}
+        self._rebuilding = False
+        self._rebuilt_at = 0
+        #hostname -> tors it is cabled to, (tor_ip, hostname) -> ifindex.
+        self._host_tors = {}
+        self._host_index = {}
+        self._subscribers = []
+        self._refresh = None
+        self._refresh_next = 0
 
         self._init_data()
 
     @property
     def topology(self):
-        if self._topology == {}:
-            self._get_topology()
-        return self._topology
+        return self.snapshot().topology
 
     @property
     def topology_sp(self):
-        if self._topology_sp == {}:
-            self._get_topology()
-        return self._topology_sp
+        return self.snapshot().topology_sp
+
+    @property
+    def missing(self):
+        return self._missing
 
     @property
     def topofracks(self):
@@ -64,19 +150,87 @@ class TopofRacks(object):
     def topofracks(self, topofracks):
         self._topofracks = topofracks
         if self._topofracks != []:
-            self._get_topology()
+            self.rebuild(force=True)
+
+    def snapshot(self):
+        """The topology as last read, without waiting for any switch. Tors
+        never read or missing are read again in the background."""
+        snapshot = Snapshot(self._topology, self._topology_sp, self._missing,
+                            self._age())
+        if self._stale():
+            self.rebuild()
+        return snapshot
+
+    def _age(self):
+        read_at = [self._read_at.get(tor) for tor in self.topofracks]
+        if not read_at or None in read_at:
+            return None
+        return time.time() - min(read_at)
+
+    def _stale(self):
+        return [tor for tor in self.topofracks
+                if tor not in self._read_at or tor in self._missing]
+
+    def rebuild(self, force=False):
+        """Read the tors never read or missing again in a green thread of
+        its own, once in rebuild_interval seconds unless force is True."""
+        if self._rebuilding:
+            return
+        if not force and time.time() - self._rebuilt_at < CONF.topology.rebuild_interval:
+            return
+        self._rebuilding = True
+        self._rebuilt_at = time.time()
+        eventlet.spawn_n(self._rebuild)
+
+    def _rebuild(self):
+        try:
+            self._apply(self._discover_all(self._stale()))
+        except Exception:
+            print traceback.format_exc()
+        finally:
+            self._rebuilding = False
 
     def get_up_tor(self, host):
-        for tor in self._topology_sp:
-            if host in self._topology_sp[tor]:
-                return tor
+        tors = self._host_tors.get(host)
+        if tors:
+            return min(tors)
         return None
 
-    def _get_index(self, host):
-        for _, index_info in self._topology.items():
-            for index in index_info:
-                if index_info[index]["host"] == host:
-                    return int(index)
+    def _get_index(self, tor_ip, host):
+        return self._host_index.get((tor_ip, host))
+
+    def _set_tors(self, updates):
+        """Replace the neighbours of the tors in updates, (tor, topology,
+        topology_sp) each, updating the host indexes of those tors only.
+        The topology dicts are copied and replaced once for them all."""
+        if not updates:
+            return
+        for tor, topology, topology_sp in updates:
+            self._index_tor(tor, topology)
+        topologies, topologies_sp = dict(self._topology), dict(self._topology_sp)
+        for tor, topology, topology_sp in updates:
+            topologies[tor], topologies_sp[tor] = topology, topology_sp
+        self._topology, self._topology_sp = topologies, topologies_sp
+
+    def _index_tor(self, tor, topology):
+        """Move the host indexes of tor from its published neighbours to
+        topology."""
+        indexes = {}
+        for index in sorted(topology):
+            indexes.setdefault(topology[index]["host"], int(index))
+        for index, info in self._topology.get(tor, {}).items():
+            host = info["host"]
+            if host in indexes:
+                continue
+            self._host_index.pop((tor, host), None)
+            tors = self._host_tors.get(host)
+            if tors:
+                tors.discard(tor)
+                if not tors:
+                    del self._host_tors[host]
+        for host, index in indexes.items():
+            self._host_index[(tor, host)] = index
+            self._host_tors.setdefault(host, set()).add(tor)
 
     def _get_vlan_id(self, tor_ip, shared, id):
         vlan = None
@@ -90,7 +244,7 @@ class TopofRacks(object):
 
     def get_localvlan(self, network, port, tor_ip, host):
         id = self._get_cache_id(tor_ip, network["network_id"], network["shared"])
-        index = self._get_index(host)
+        index = self._get_index(tor_ip, host)
 
         if id in self._topofracks_lvm_cache:
             vlan = self._topofracks_lvm_cache[id]
@@ -147,25 +301,153 @@ class TopofRacks(object):
             oid = '.' + oid
         return [SNMPWALK, '-v', version, '-c', community, ip, oid]
 
+    def _snmpwalk(self, ip, items):
+        """Walk only the LLDP columns and scalars in items, side by side,
+        return (oid, value) pairs written the way snmpwalk prints them."""
+        oids = ["1" + item[len("iso"):] for item in items]
+        if CONF.topology.snmp_client == 'getbulk':
+            scalars = [oid[:-len(".0")] for oid in oids if oid.endswith(".0")]
+            columns = [oid for oid in oids if not oid.endswith(".0")]
+            return [("iso." + ".".join(map(str, name[1:])), _text(value))
+                    for name, value in snmp.CLIENT.walk_columns(ip, columns, scalars)]
+        #kept to be killed when the discovery times out, which kills
+        #their snmpwalk too.
+        walks = [eventlet.spawn(utils.execute, self._snmpwalk_cmd('public', ip, oid))
+                 for oid in oids]
+        walked = []
+        try:
+            for walk in walks:
+                for line in [line for line in walk.wait().split('\n') if line != '']:
+                    content = line.split(' ')
+                    walked.append((content[0], ' '.join(content[3:]).strip("\"")))
+        finally:
+            for walk in walks:
+                walk.kill()
+        return walked
+
     def _get_topology(self):
-        for topofrack in self.topofracks:
-
-            self._topology[topofrack] = {}
-            self._topology_sp[topofrack] = []
-            local = self._parse_local_data(topofrack)
-            remote = self._parse_remote_data(topofrack)
-
-            for index in remote:
-                self._topology[topofrack][index] = {}
-                self._topology[topofrack][index]['index_name'] = local['indexs'][index]
-                self._topology[topofrack][index]['tor_ip'] = topofrack
-                self._topology[topofrack][index]['tor'] = local['sysname']
-                self._topology[topofrack][index]['host'] = remote[index]['hostname']
-                self._topology[topofrack][index]['desc'] = remote[index]['hostdesc']
-                self._topology[topofrack][index]['host_ip'] = remote[index]['ip']
-                self._topology[topofrack][index]['mac'] = remote[index]['mac']
-                self._topology[topofrack][index]['interface'] = remote[index]['desc']
-                self._topology_sp[topofrack].append(remote[index]['hostname'])
+        """Read the LLDP data of all tors concurrently, a tor which does not
+        answer keeps what was known of it and is marked missing."""
+        missing, updates = set(), []
+        for topofrack, data in self._discover_all(self.topofracks):
+            if data is None:
+                missing.add(topofrack)
+                if topofrack not in self._topology:
+                    updates.append((topofrack, {}, []))
+            else:
+                self._read_at[topofrack] = time.time()
+                updates.append((topofrack,) + tuple(data))
+        self._set_tors(updates)
+        self._missing = frozenset(missing)
+        if missing:
+            print "lldp data of tors %s is missing" %(", ".join(sorted(missing)))
+
+    def _discover_all(self, tors):
+        pool = eventlet.GreenPool(max(CONF.topology.discovery_concurrency, 1))
+        walks = [(tor, pool.spawn(self._discover, tor)) for tor in tors]
+        return [(tor, walk.wait()) for tor, walk in walks]
+
+    def subscribe(self, callback):
+        """Call callback(events) with the events of every tor a refresh
+        finds changed, see diff."""
+        self._subscribers.append(callback)
+
+    def start_refresh(self):
+        """Read refresh_slice tors again every refresh_interval seconds,
+        going round all of them."""
+        interval = CONF.topology.refresh_interval
+        if interval <= 0 or self._refresh:
+            return
+        self._refresh = utils.FixedIntervalLoopingCall(self._refresh_slice)
+        self._refresh.start(interval=interval, initial_delay=interval)
+
+    def stop_refresh(self):
+        if self._refresh:
+            self._refresh.stop()
+            self._refresh = None
+
+    def _refresh_slice(self):
+        tors = list(self.topofracks)
+        if not tors:
+            return
+        size = min(max(CONF.topology.refresh_slice, 1), len(tors))
+        start = self._refresh_next % len(tors)
+        self._refresh_next = start + size
+        try:
+            self._apply(self._discover_all((tors + tors)[start:start + size]))
+        except Exception:
+            print traceback.format_exc()
+
+    def _apply(self, results):
+        """Take the topologies read again, (tor, data) pairs, of the tors
+        never read before or changed, and publish the changes."""
+        missing, found = set(), set()
+        updates, changes = [], []
+        for tor, data in results:
+            if data is None:
+                missing.add(tor)
+                continue
+            self._read_at[tor] = time.time()
+            found.add(tor)
+            events = diff(tor, self._topology.get(tor, {}), data[0])
+            if events or tor not in self._topology:
+                updates.append((tor,) + tuple(data))
+            if events:
+                changes.append((tor, events))
+        if missing or found & self._missing:
+            self._missing = (self._missing | missing) - found
+        self._set_tors(updates)
+        for tor, events in changes:
+            for event in events:
+                print "topology of tor %s: host %s %s on port %s" %(
+                        tor, event["host"], event["event"], event["index"])
+            for callback in self._subscribers:
+                try:
+                    callback(events)
+                except Exception:
+                    print traceback.format_exc()
+
+    def _discover(self, ip):
+        """Read the topology of one tor, None when it fails or takes longer
+        than discovery_timeout."""
+        timeout = eventlet.Timeout(CONF.topology.discovery_timeout or None)
+        try:
+            local, remote = self._walk(ip)
+            #a walk which failed leaves the local data empty.
+            if 'sysname' not in local:
+                return None
+            return self._build(ip, local, remote)
+        except eventlet.Timeout as t:
+            if t is not timeout:
+                raise
+            print "reading lldp data of tor %s timed out" %(ip)
+        except Exception:
+            print traceback.format_exc()
+        finally:
+            timeout.cancel()
+        return None
+
+    def _build(self, topofrack, local, remote):
+        topology, topology_sp = {}, []
+        for index in remote:
+            topology[index] = {}
+            topology[index]['index_name'] = local['indexs'][index]
+            topology[index]['tor_ip'] = topofrack
+            topology[index]['tor'] = local['sysname']
+            topology[index]['host'] = remote[index]['hostname']
+            topology[index]['desc'] = remote[index]['hostdesc']
+            topology[index]['host_ip'] = remote[index]['ip']
+            topology[index]['mac'] = remote[index]['mac']
+            topology[index]['interface'] = remote[index]['desc']
+            topology_sp.append(remote[index]['hostname'])
+        return topology, topology_sp
+
+    def _walk(self, ip):
+        if CONF.topology.source == 'netconf' and self._lldp:
+            data = self._lldp(ip)
+            if data is not None:
+                return data
+        return self._parse_local_data(ip), self._parse_remote_data(ip)
 
     def _is_oid(self, oid):
         for i in LLDP_LOCAL_ITEMS + LLDP_REMOTE_ITEMS:
@@ -177,14 +459,8 @@ class TopofRacks(object):
         local = {}
         local['indexs'] = {}
         local['mgrs'] = {}
-        cmd = self._snmpwalk_cmd('public', ip, LLDP_LOCAL_OID)
         try:
-            returnvalue = utils.execute(cmd)
-            for line in [line for line in returnvalue.split('\n') if line != '']:
-                content = line.split(' ')
-                oid, result= content[0], ' '.join(content[3:])
-                result = result.strip("\"")
-
+            for oid, result in self._snmpwalk(ip, LLDP_LOCAL_ITEMS):
                 case = self._is_oid(oid)
                 if not case:
                     continue
@@ -207,19 +483,12 @@ class TopofRacks(object):
                     continue
         except RuntimeError:
             print traceback.format_exc()
-        finally:
-            return local
+        return local
 
     def _parse_remote_data(self, ip):
         remote = {}
-        cmd = self._snmpwalk_cmd('public', ip, LLDP_REMOTE_OID)
         try:
-            returnvalue = utils.execute(cmd)
-            for line in [line for line in returnvalue.split('\n') if line != '']:
-                content = line.split(' ')
-                oid, result= content[0], ' '.join(content[3:])
-                result = result.strip("\"")
-
+            for oid, result in self._snmpwalk(ip, LLDP_REMOTE_ITEMS):
                 case = self._is_oid(oid)
                 if not case:
                     continue
@@ -246,5 +515,4 @@ class TopofRacks(object):
                     remote[index]['ip'] = ip
         except RuntimeError:
             print traceback.format_exc()
-        finally:
-            return remote
+        return remote
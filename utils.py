@@ -3,6 +3,7 @@
 import signal
 import os
 import sys
+import functools
 
 #import eventlet.wsgi
 #eventlet.patcher.monkey_patch(all=False, thread=None, socket=True)
@@ -14,9 +15,21 @@ import sys
 from eventlet import event
 from eventlet.green import subprocess
 from eventlet import greenthread
+from eventlet import patcher
+from eventlet import tpool
+from oslo.config import cfg
 
 from torconf import timeutils
 
+tpool_opts = [
+    cfg.IntOpt('tpool_size', default=20,
+               help="Native threads running blocking switch and database "
+                    "calls off the eventlet hub, 0 runs them on the hub"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(tpool_opts)
+
 class LocalVLanBitmap(object):
     """Setup a VLAN bitmap for allocation or de-allocation."""
 
@@ -88,7 +101,13 @@ def execute(cmd, check_exit_code=True):
                 stderr=subprocess.PIPE,
                 env=os.environ.copy())
 
-        _stdout, stderr = obj.communicate()
+        try:
+            _stdout, stderr = obj.communicate()
+        except BaseException:
+            #interrupted, e.g. by a timeout, do not leave the child behind.
+            obj.kill()
+            obj.wait()
+            raise
         obj.stdin.close()
 
         m = "cmd: %s exit code: %s." %(cmd, obj.returncode)
@@ -99,6 +118,30 @@ def execute(cmd, check_exit_code=True):
 
     return _stdout
 
+_tpool_size = None
+
+def offload(func, *args, **kwargs):
+    """Run a blocking call on a native thread, the other green threads
+    keep running meanwhile."""
+    global _tpool_size
+    size = CONF.tpool_size
+    #with green threading ncclient waits on green events, which a native
+    #thread can not.
+    if size <= 0 or patcher.is_monkey_patched('thread'):
+        return func(*args, **kwargs)
+    if _tpool_size is None:
+        #only takes effect before the first call sets the pool up.
+        tpool.set_num_threads(size)
+        _tpool_size = size
+    return tpool.execute(func, *args, **kwargs)
+
+def blocking(func):
+    """Decorate a function doing blocking I/O to run it with offload."""
+    @functools.wraps(func)
+    def _offloaded(*args, **kwargs):
+        return offload(func, *args, **kwargs)
+    return _offloaded
+
 class LoopingCallDone(Exception):
     def __init__(self, retvalue=True):
         """:param retvalue: Value that LoopingCall.wait() should return."""
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import eventlet
+from eventlet import corolocal
+from oslo.config import cfg
+
+from torconf.base import SwitchDriverBase
+
+writebehind_opts = [
+    cfg.FloatOpt('write_behind_window', default=0,
+                 help="Seconds port edits are held back per switch to be "
+                      "coalesced into one batch, 0 sends them right away"),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(writebehind_opts)
+
+NEW = 'newvlan2vxlan'
+DELETE = 'deletevlan2vxlan'
+BIND = 'ensureVxlanWithTunnel'
+
+
+class _Pending(object):
+    """Edits of one switch waiting to be flushed."""
+
+    def __init__(self, user, passwd):
+        self.user = user
+        self.passwd = passwd
+        #the timer queueing the flush, None while none is due.
+        self.timer = None
+        self._reset()
+
+    def _reset(self):
+        self.ops = []
+        self.seen = set()
+        #last create or delete buffered per (ifindex, vlan, vxlan)
+        self.last = {}
+
+    def _append(self, op):
+        if op in self.seen:
+            return
+        self.ops.append(op)
+        self.seen.add(op)
+
+    def add_new(self, key):
+        self._append((NEW, key))
+        self.last[key] = NEW
+
+    def add_delete(self, key, only_index):
+        if self.last.get(key) == NEW:
+            #the port never reached the switch, only the vsi and the
+            #vxlan may still have to go.
+            self.ops.remove((NEW, key))
+            self.seen.discard((NEW, key))
+            self.last[key] = self._last(key)
+            if only_index:
+                return
+            vxlan = key[2]
+            self.ops = [op for op in self.ops
+                        if not (op[0] == BIND and op[1][0] == vxlan)]
+            self.seen = set(self.ops)
+        self._append((DELETE, key + (only_index,)))
+        self.last[key] = DELETE
+
+    def add_bind(self, vxlan, tunnel_id):
+        self._append((BIND, (vxlan, tunnel_id)))
+
+    def _last(self, key):
+        for method, args in reversed(self.ops):
+            if method in (NEW, DELETE) and args[:3] == key:
+                return method
+        return None
+
+    def take(self):
+        ops = self.ops
+        self._reset()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        calls = []
+        for method, args in ops:
+            if method == BIND:
+                calls.append((BIND, ([args[0]], [args[1]])))
+            else:
+                calls.append((method, args))
+        return calls
+
+
+class WriteBehindDriver(SwitchDriverBase):
+    """Holds back the port edits of a driver and sends them in batches.
+
+    newvlan2vxlan, deletevlan2vxlan and ensureVxlanWithTunnel are buffered
+    per switch for write_behind_window seconds. A delete cancels the
+    buffered create it undoes, repeated edits are dropped, and what is
+    left goes to the switch as one batch on the queue of the tor. Tunnel
+    edits flush the buffer of their switch and pass straight through.
+
+    The buffered calls report success right away. When a flush fails or
+    its edits are dropped, on_failure(mgr) is called so the caller can
+    bring the switch back in line, e.g. by reconciling it.
+    """
+
+    def __init__(self, driver, dispatcher, window, on_failure=None):
+        self.driver = driver
+        self.dispatcher = dispatcher
+        self.window = window
+        self.on_failure = on_failure
+        self._local = corolocal.local()
+        self._pending = {}
+
+    @property
+    def mgr(self):
+        return getattr(self._local, 'mgr', None)
+
+    def initialize(self, mgr, user, passwd):
+        self._local.mgr = mgr
+        pending = self._pending.get(mgr)
+        if pending is None:
+            self._pending[mgr] = _Pending(user, passwd)
+        else:
+            pending.user, pending.passwd = user, passwd
+        return self.driver.initialize(mgr, user, passwd)
+
+    def _buffer(self):
+        pending = self._pending[self.mgr]
+        if pending.timer is None:
+            pending.timer = eventlet.spawn_after(self.window, self.dispatcher.submit,
+                                                 self.mgr, self._flush_job, self.mgr)
+        return pending
+
+    def forget(self, mgr):
+        """Drop the buffered edits of mgr and cancel their flush, once the
+        tor is deleted."""
+        pending = self._pending.pop(mgr, None)
+        if pending:
+            pending.take()
+        self.driver.forget(mgr)
+
+    def _flush(self, mgr):
+        """Send the buffered edits of mgr with the driver set up for it."""
+        pending = self._pending.get(mgr)
+        if not pending or not pending.ops:
+            return True
+        calls = pending.take()
+        failed = self.driver.batch(calls)
+        for method, args in failed:
+            print "write behind: %s%s failed on tor %s" %(method, args, mgr)
+        return not failed
+
+    def _failed(self, mgr):
+        if self.on_failure:
+            self.on_failure(mgr)
+        return False
+
+    def _flush_job(self, mgr):
+        pending = self._pending.get(mgr)
+        if not pending or not pending.ops:
+            return True
+        if not self.driver.initialize(mgr, pending.user, pending.passwd):
+            print "write behind: tor %s unreachable, %d edits dropped" %(
+                    mgr, len(pending.take()))
+            return self._failed(mgr)
+        self._local.mgr = mgr
+        try:
+            with self.driver.transaction():
+                ok = self._flush(mgr)
+        except Exception as e:
+            print "write behind: flush on tor %s failed: %s" %(mgr, e)
+            return self._failed(mgr)
+        return ok or self._failed(mgr)
+
+    def _flush_now(self):
+        """Flush the edits of the current tor ahead of a call which does
+        not go through the buffer."""
+        return self._flush(self.mgr) or self._failed(self.mgr)
+
+    def newtunnel(self, src, dst):
+        self._flush_now()
+        return self.driver.newtunnel(src, dst)
+
+    def deletetunnel(self, tunnel_id):
+        self._flush_now()
+        return self.driver.deletetunnel(tunnel_id)
+
+    def newvlan2vxlan(self, ifindex, vlan, vxlan):
+        self._buffer().add_new((ifindex, vlan, vxlan))
+        return True
+
+    def deletevlan2vxlan(self, ifindex, vlan, vxlan, only_index=False):
+        self._buffer().add_delete((ifindex, vlan, vxlan), only_index)
+        return True
+
+    def ensureVxlanWithTunnel(self, vxlans, tunnel_ids):
+        pending = self._buffer()
+        for vxlan in vxlans:
+            for tunnel_id in tunnel_ids:
+                pending.add_bind(vxlan, tunnel_id)
+        return True
+
+    def begin(self):
+        self.driver.begin()
+
+    def in_transaction(self):
+        return self.driver.in_transaction()
+
+    def commit(self):
+        return self.driver.commit()
+
+    def rollback(self):
+        self.driver.rollback()
+
+    def reconcile(self, desired):
+        self._flush_now()
+        return self.driver.reconcile(desired)
+
+    def batch(self, ops):
+        self._flush_now()
+        return self.driver.batch(ops)
+
+    def lldp(self):
+        return self.driver.lldp()